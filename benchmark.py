@@ -0,0 +1,173 @@
+# benchmark.py — HOST HOT-LOOP BENCHMARK
+# Compares the original copy-heavy frame path with the preallocated/zero-copy one:
+# time per frame, transient memory allocated per frame, and bytes on the wire.
+#
+# Usage:
+#   python benchmark.py --width 2560 --height 1440 --frames 100
+#   python benchmark.py --recording recordings/session_x.lssrec
+
+import argparse
+import pickle
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from capture import FrameEncoder, RING_SIZE, serialize
+from protocol import OutgoingMessage, VIDEO, CHUNK_SIZE
+
+class FakeShot:
+    """Stands in for an mss ScreenShot: BGRA bytearray plus the array interface"""
+
+    def __init__(self, bgra):
+        self.height, self.width = bgra.shape[:2]
+        self.raw = bytearray(bgra.tobytes())
+
+    @property
+    def __array_interface__(self):
+        return {
+            'version': 3,
+            'shape': (self.height, self.width, 4),
+            'typestr': '|u1',
+            'data': self.raw,
+        }
+
+def synthetic_frames(width, height, count):
+    """Desktop-like frames: gradient background, text-ish noise rows and a moving window"""
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.dstack([(x * 255 // width), (y * 255 // height), np.full_like(x, 96), np.full_like(x, 255)])
+    base = base.astype(np.uint8)
+    rng = np.random.default_rng(0)
+    for row in range(0, height, 24):
+        base[row:row + 10, 40:width // 2, :3] = rng.integers(0, 255, (min(10, height - row), width // 2 - 40, 3))
+    shots = []
+    for i in range(count):
+        frame = base.copy()
+        left = (i * 17) % max(1, width - 400)
+        frame[100:400, left:left + 400, :3] = 230
+        shots.append(FakeShot(frame))
+    return shots
+
+def recorded_frames(path, count):
+    """Decode frames from a session recording as BGRA grabs"""
+    from recording import SessionReader
+    shots = []
+    with SessionReader(path) as reader:
+        for _, _, payload in reader.frames():
+            packet_info = pickle.loads(payload)
+            payload.release()
+            if packet_info.get('type', 'key') != 'key':
+                continue  # Resume deltas only hold changed tiles
+            frame = cv2.imdecode(packet_info['screen'], cv2.IMREAD_COLOR)
+            if frame is not None:
+                shots.append(FakeShot(cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)))
+            if len(shots) >= count:
+                break
+    return shots
+
+def packet(buffer, shot):
+    return {
+        'screen': buffer,
+        'mouse_x': 0,
+        'mouse_y': 0,
+        'mouse_visible': True,
+        'controlling': False,
+        'screen_width': shot.width,
+        'screen_height': shot.height,
+        'timestamp': time.time(),
+    }
+
+def legacy_path(shot, sock, quality):
+    """The original host loop body"""
+    img_np = np.array(shot)
+    img_bgr = cv2.cvtColor(img_np, cv2.COLOR_BGRA2BGR)
+    _, buffer = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    data = pickle.dumps(packet(buffer, shot), 0)
+    sock.sendall(struct.pack(">L", len(data)) + data)
+    return len(data) + 4
+
+def make_zero_copy_path():
+    encoder = FrameEncoder()
+
+    def zero_copy_path(shot, sock, quality):
+        img_bgr = encoder.to_bgr(shot)
+        buffer = encoder.encode(img_bgr, quality)
+        data = serialize(packet(buffer, shot))
+        message = OutgoingMessage(data)
+        wire, last = 0, False
+        while not last:
+            sent, last = message.write_chunk(sock, VIDEO, CHUNK_SIZE)
+            wire += sent
+        return wire
+
+    return zero_copy_path
+
+def drain(sock):
+    try:
+        while sock.recv(1 << 20):
+            pass
+    except OSError:
+        pass
+
+def run(name, path, shots, quality):
+    tx, rx = socket.socketpair()
+    threading.Thread(target=drain, args=(rx,), daemon=True).start()
+
+    for shot in shots[:RING_SIZE]:
+        path(shot, tx, quality)  # Warm up every ring buffer and the codec tables
+    frame_bytes = shots[0].width * shots[0].height * 4
+    times, peaks, wire = [], [], 0
+
+    tracemalloc.start()
+    for shot in shots:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        wire += path(shot, tx, quality)
+        times.append(time.perf_counter() - t)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    tx.close()
+    rx.close()
+    times.sort()
+    peak = sum(peaks) / len(peaks)
+    return {
+        'name': name,
+        'mean_ms': sum(times) / len(times) * 1000,
+        'p95_ms': times[int(len(times) * 0.95) - 1] * 1000,
+        'peak_alloc_mb': peak / 1e6,
+        'frame_copies': peak / frame_bytes,
+        'wire_kb': wire / len(shots) / 1e3,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the host capture/encode/send path")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--quality", type=int, default=45)
+    parser.add_argument("--recording", help="Use frames from a session recording instead of synthetic ones")
+    args = parser.parse_args()
+
+    if args.recording:
+        shots = recorded_frames(args.recording, args.frames)
+    else:
+        shots = synthetic_frames(args.width, args.height, args.frames)
+    if not shots:
+        print("No frames to benchmark")
+        return
+
+    print(f"📊 {len(shots)} frames at {shots[0].width}x{shots[0].height}, JPEG quality {args.quality}")
+    print(f"{'path':<10} {'mean ms':>8} {'p95 ms':>8} {'alloc MB/frame':>15} {'frame copies':>13} {'wire KB':>8}")
+    for name, path in (('legacy', legacy_path), ('zero-copy', make_zero_copy_path())):
+        r = run(name, path, shots, args.quality)
+        print(f"{r['name']:<10} {r['mean_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['peak_alloc_mb']:>15.2f} "
+              f"{r['frame_copies']:>13.2f} {r['wire_kb']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
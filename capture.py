@@ -0,0 +1,93 @@
+# capture.py — HOST FRAME PIPELINE BUFFERS
+# Zero-copy view over the mss grab buffer and a reused BGR destination array
+#
+# The old loop made a full-frame copy at every step: np.array(img), cvtColor into a
+# fresh array, imencode, pickle protocol 0 (which also escapes every high byte) and
+# struct.pack(...) + data. Here the grab buffer is viewed in place, conversion writes
+# into a small ring of preallocated arrays, and the packet goes out in chunks that
+# are views into the pickled bytes.
+#
+# The ring keeps the last few BGR frames addressable by sequence number, so a client
+# that reconnects holding one of them can be brought up to date with just the tiles
+# that changed (encode_delta) instead of a full frame.
+
+import pickle
+
+import cv2
+import numpy as np
+
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+RING_SIZE = 4
+TILE_SIZE = 64
+
+def bgra_view(img):
+    """NumPy view over an mss ScreenShot's BGRA buffer without copying it"""
+    return np.frombuffer(img.raw, dtype=np.uint8).reshape(img.height, img.width, 4)
+
+class FrameEncoder:
+    """Reusable buffers for the grab -> BGR -> JPEG path of one capture thread"""
+
+    def __init__(self, ring_size=RING_SIZE):
+        self.ring = [None] * ring_size
+        self.ring_seq = [None] * ring_size
+        self.slot = 0
+        self.allocations = 0  # Times a ring buffer had to be (re)allocated
+
+    def to_bgr(self, img, seq=None):
+        """Convert a grab into the next ring buffer, tagged with seq, and return it"""
+        bgra = bgra_view(img)
+        h, w = bgra.shape[:2]
+        self.slot = (self.slot + 1) % len(self.ring)
+        bgr = self.ring[self.slot]
+        if bgr is None or bgr.shape[:2] != (h, w):
+            bgr = self.ring[self.slot] = np.empty((h, w, 3), dtype=np.uint8)
+            self.allocations += 1
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=bgr)
+        self.ring_seq[self.slot] = seq
+        return bgr
+
+    def frame_for(self, seq):
+        """The BGR frame captured as seq, if it is still in the ring"""
+        if seq is None:
+            return None
+        for slot, slot_seq in enumerate(self.ring_seq):
+            if slot_seq == seq:
+                return self.ring[slot]
+        return None
+
+    def encode(self, bgr, quality):
+        """JPEG-encode a BGR frame"""
+        ok, buffer = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise RuntimeError("JPEG encode failed")
+        return buffer
+
+def encode_delta(prev, cur, quality, tile=TILE_SIZE):
+    """JPEG-encode only the tiles of cur that differ from prev: [(x, y, jpeg), ...]"""
+    changed = np.any(prev != cur, axis=2)
+    h, w = changed.shape
+    tiles = []
+    for y in range(0, h, tile):
+        for x in range(0, w, tile):
+            if changed[y:y + tile, x:x + tile].any():
+                ok, buffer = cv2.imencode('.jpg', cur[y:y + tile, x:x + tile], [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if ok:
+                    tiles.append((x, y, buffer))
+    return tiles
+
+def clamp_view(view, monitor, min_size=64):
+    """Fit a requested (x, y, w, h) view inside the monitor; None for the whole screen"""
+    if not view:
+        return None
+    x, y, w, h = view
+    w = max(min_size, min(w, monitor['width']))
+    h = max(min_size, min(h, monitor['height']))
+    if (w, h) == (monitor['width'], monitor['height']):
+        return None
+    x = max(0, min(x, monitor['width'] - w))
+    y = max(0, min(y, monitor['height'] - h))
+    return (x, y, w, h)
+
+def serialize(packet_data):
+    """Binary pickle of a packet; readable by any pickle.loads on the client"""
+    return pickle.dumps(packet_data, PICKLE_PROTOCOL)
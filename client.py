@@ -2,18 +2,41 @@
 # Simplified protocol that actually works with mouse synchronization
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import threading
 import socket
-import struct
 import pickle
 import cv2
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk
 import numpy as np
 from pynput import mouse, keyboard
 import time
+import json
 import concurrent.futures
 
+from recording import SessionRecorder, recording_path, replay
+from stats import PipelineStats
+from protocol import MuxConnection, VIDEO, CURSOR, INPUT, CONTROL, limit_unsent
+from udp_transport import UdpFrameReceiver, open_udp_socket
+from filetransfer import FileSender
+from shm_transport import ShmFrameReader
+
+RECORD_DIR = "recordings"
+STATS_PORT = 65434  # Local JSON stats endpoint, None to disable
+STATS_LOG = None  # Set to a file path for a periodic JSON stats log
+MAX_PENDING_FRAMES = 2  # Frames waiting for the Tk thread before new ones are dropped
+UDP_FEC_GROUP = 8  # Data fragments per XOR parity fragment, 0 disables FEC
+UDP_LOSS = 0.0  # Simulated receive-side loss for testing the UDP path
+KEYFRAME_REQUEST_INTERVAL = 0.2  # Seconds between keyframe requests after UDP loss
+BULK_RATE_LIMIT = None  # Bytes per second cap for file transfers, None = as fast as the host takes them
+RESUME_GRACE = 30.0  # Seconds to keep retrying a dropped connection; matches the host
+RECONNECT_DELAY = 0.5
+ZOOM_LEVELS = (1.0, 1.5, 2.0, 3.0, 4.0)  # F9 / F8 step through these
+EDGE_PAN = 0.04  # Fraction of the screen at each edge that pans a zoomed view
+PAN_STEP = 0.1  # Fraction of the view moved per pan
+LOCAL_KEYS = ('f8', 'f9', 'f11', 'f12', 'escape')  # Handled here, never sent to the host
+SHM_LOCAL = True  # Map frames from shared memory when the host is this machine
+
 class RemoteClientApp:
     def __init__(self, root):
         self.root = root
@@ -25,12 +48,34 @@ class RemoteClientApp:
         self.connected = False
         self.target_ip = None
         self.sock = None
+        self.mux = None
+        self.file_sender = None
+        self.udp_sock = None
+        self.shm_reader = None
+        self.shm_name = None  # Segment the host last told us to map
+        self.last_keyframe_request = 0
         self.running = False
+
+        # Session resume
+        self.session_token = None
+        self.reconnecting = False
+        self.frame_seq = None  # Sequence number of the frame in framebuffer
+        self.framebuffer = None  # Full-resolution BGR frame that deltas apply to
         self.fullscreen = False
         
+        # Session recording and replay
+        self.recorder = None
+        self.replaying = False
+        self.replay_stop = None
+        
         # Remote desktop dimensions
         self.remote_width = 1920
         self.remote_height = 1080
+
+        # Zoomed region of the remote screen: requested, and what the current frame shows
+        self.zoom_index = 0
+        self.view = None
+        self.frame_view = None
         
         # Mouse synchronization
         self.remote_mouse_pos = (0, 0)
@@ -38,6 +83,13 @@ class RemoteClientApp:
         self.mouse_over_canvas = False
         self.client_cursor_hidden = False
         self.show_remote_cursor = True
+        self.cursor_shapes = {}  # Shape id -> (RGBA image, hotspot), sent once per shape by the host
+        self.remote_cursor_shape = None
+        self.scaled_cursor_cache = {}  # (shape id, scale) -> (PhotoImage, hotspot)
+        self.cursor_updates = False  # The host streams the cursor channel; frames carry a staler position
+        self.cursor_redraw_pending = False
+        self.frame_origin = (0, 0)  # Where the last frame sits on the canvas, and its size
+        self.frame_size = None
         
         # Performance tracking
         self.frame_count = 0
@@ -45,6 +97,11 @@ class RemoteClientApp:
         self.fps = 0
         self.latency = 0
         self.last_ping_time = 0
+        self.stats = PipelineStats("client")
+        self.host_stats = None
+        self.pending_frames = 0
+        self.show_stats_overlay = False
+        self.stats_overlay_text = ""
         
         self.top_widgets = []
         self.setup_ui()
@@ -54,6 +111,10 @@ class RemoteClientApp:
         self.keyboard_listener = None
         
         # Start performance monitoring
+        if STATS_PORT:
+            self.stats.serve(STATS_PORT)
+        if STATS_LOG:
+            self.stats.start_json_log(STATS_LOG)
         threading.Thread(target=self.monitor_performance, daemon=True).start()
 
     def setup_ui(self):
@@ -136,6 +197,24 @@ class RemoteClientApp:
                                           bg="#5a2d5a", fg="white", relief="flat",
                                           font=("Segoe UI", 10), padx=15)
         self.fullscreen_button.pack(side=tk.LEFT, padx=5)
+
+        self.record_button = tk.Button(conn_frame, text="⏺ Record", 
+                                      command=self.toggle_recording,
+                                      bg="#5a2d2d", fg="white", relief="flat",
+                                      font=("Segoe UI", 10), padx=15)
+        self.record_button.pack(side=tk.LEFT, padx=5)
+
+        self.replay_button = tk.Button(conn_frame, text="▶ Replay", 
+                                      command=self.toggle_replay,
+                                      bg="#2d4d5a", fg="white", relief="flat",
+                                      font=("Segoe UI", 10), padx=15)
+        self.replay_button.pack(side=tk.LEFT, padx=5)
+
+        self.send_file_button = tk.Button(conn_frame, text="📁 Send File", 
+                                         command=self.send_file, state=tk.DISABLED,
+                                         bg="#2d5a2d", fg="white", relief="flat",
+                                         font=("Segoe UI", 10), padx=15)
+        self.send_file_button.pack(side=tk.LEFT, padx=5)
         
         # Mouse settings
         mouse_frame = tk.Frame(control_frame, bg="#0a0a0a")
@@ -144,9 +223,16 @@ class RemoteClientApp:
         self.cursor_var = tk.BooleanVar(value=True)
         cursor_check = tk.Checkbutton(mouse_frame, text="Show Remote Cursor", 
                                      variable=self.cursor_var, bg="#0a0a0a", fg="white",
-                                     selectcolor="#2d2d2d", font=("Segoe UI", 9))
+                                     selectcolor="#2d2d2d", font=("Segoe UI", 9),
+                                     command=self.draw_cursor)
         cursor_check.pack(side=tk.RIGHT, padx=5)
 
+        self.udp_var = tk.BooleanVar(value=False)
+        udp_check = tk.Checkbutton(mouse_frame, text="Low-Latency UDP", 
+                                  variable=self.udp_var, bg="#0a0a0a", fg="white",
+                                  selectcolor="#2d2d2d", font=("Segoe UI", 9))
+        udp_check.pack(side=tk.RIGHT, padx=5)
+
         # === Status Bar ===
         status_frame = tk.Frame(self.root, bg="#1a1a1a", height=30)
         status_frame.pack(fill=tk.X, side=tk.BOTTOM)
@@ -175,6 +261,9 @@ class RemoteClientApp:
         self.root.bind("<F11>", lambda e: self.toggle_fullscreen())
         self.root.bind("<Escape>", lambda e: self.exit_fullscreen())
         self.root.bind("<Control-q>", lambda e: self.disconnect())
+        self.root.bind("<F12>", lambda e: self.toggle_stats_overlay())
+        self.root.bind("<F9>", lambda e: self.zoom_in())
+        self.root.bind("<F8>", lambda e: self.zoom_out())
 
     def on_canvas_enter(self, event):
         """Mouse entered canvas"""
@@ -232,6 +321,57 @@ class RemoteClientApp:
                 else:  # List frame
                     widget.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
 
+    def toggle_stats_overlay(self):
+        """Toggle the detailed pipeline stats overlay on the canvas"""
+        self.show_stats_overlay = not self.show_stats_overlay
+        if not self.show_stats_overlay:
+            self.canvas.delete("stats")
+
+    def zoom_in(self):
+        self.set_zoom(self.zoom_index + 1)
+
+    def zoom_out(self):
+        self.set_zoom(self.zoom_index - 1)
+
+    def set_zoom(self, index):
+        """Zoom around the remote cursor; the host then streams only that region"""
+        if not self.connected:
+            return
+        self.zoom_index = max(0, min(index, len(ZOOM_LEVELS) - 1))
+        zoom = ZOOM_LEVELS[self.zoom_index]
+        if zoom == 1.0:
+            self.request_view(None)
+            return
+        w, h = int(self.remote_width / zoom), int(self.remote_height / zoom)
+        cx, cy = self.remote_mouse_pos
+        self.request_view((cx - w // 2, cy - h // 2, w, h))
+
+    def pan_view(self, dx, dy):
+        """Shift the zoomed view by a fraction of its size"""
+        if not self.view:
+            return
+        x, y, w, h = self.view
+        self.request_view((x + int(dx * w), y + int(dy * h), w, h))
+
+    def request_view(self, view):
+        """Clamp a view to the remote screen and ask the host to stream it"""
+        if view:
+            x, y, w, h = view
+            x = max(0, min(x, self.remote_width - w))
+            y = max(0, min(y, self.remote_height - h))
+            view = (x, y, w, h)
+        if view == self.view:
+            return
+        self.view = view
+        try:
+            self.mux.send_text(CONTROL, 'VIEW|' + '|'.join(map(str, view)) if view else 'VIEW')
+        except:
+            pass
+
+    def view_rect(self):
+        """Region of the remote screen shown by the current frame"""
+        return self.frame_view or (0, 0, self.remote_width, self.remote_height)
+
     def exit_fullscreen(self):
         """Exit fullscreen"""
         if self.fullscreen:
@@ -318,29 +458,93 @@ class RemoteClientApp:
         self.target_ip = ip
         self.connect_to_host()
 
+    def toggle_recording(self):
+        """Start or stop recording the incoming stream"""
+        if self.recorder:
+            self.stop_recording()
+            return
+        label = self.target_ip or "session"
+        try:
+            self.recorder = SessionRecorder(recording_path(RECORD_DIR, label))
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not start recording:\n{str(e)}")
+            return
+        self.record_button.config(text="⏹ Stop Recording", bg="#aa3333")
+
+    def stop_recording(self):
+        """Finish the current recording"""
+        recorder, self.recorder = self.recorder, None
+        if recorder:
+            recorder.close()
+        self.record_button.config(text="⏺ Record", bg="#5a2d2d")
+
+    def toggle_replay(self):
+        """Replay a recording through the normal renderer"""
+        if self.replaying:
+            self.stop_replay()
+            return
+        if self.connected:
+            messagebox.showerror("Error", "Disconnect before replaying a recording")
+            return
+
+        path = filedialog.askopenfilename(title="Open Recording", initialdir=RECORD_DIR,
+                                          filetypes=[("Session recordings", "*.lssrec"), ("All files", "*.*")])
+        if not path:
+            return
+
+        self.replaying = True
+        self.replay_stop = threading.Event()
+        self.frame_seq = None
+        self.framebuffer = None
+        self.connection_label.config(text=f"📼 Replaying {path}", fg="#ffaa00")
+        self.replay_button.config(text="⏹ Stop Replay")
+
+        def _run():
+            try:
+                replay(path, self.handle_packet, speed=1.0, stop_event=self.replay_stop)
+            except Exception as e:
+                print(f"Replay error: {e}")
+            self.root.after(0, self.stop_replay)
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def stop_replay(self):
+        """Stop an active replay"""
+        if not self.replaying:
+            return
+        self.replaying = False
+        self.replay_stop.set()
+        self.connection_label.config(text="Not Connected", fg="#ff6666")
+        self.replay_button.config(text="▶ Replay")
+        self.perf_label.config(text="FPS: -- | Latency: -- ms")
+
     def connect_to_host(self):
         """Connect to host"""
         if not self.target_ip:
             messagebox.showerror("Error", "No host selected!")
             return
+        if self.replaying:
+            self.stop_replay()
 
         try:
             self.connection_label.config(text=f"🔄 Connecting...", fg="#ffaa00")
             self.connect_button.config(state=tk.DISABLED, text="Connecting...")
             self.root.update_idletasks()
 
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-            self.sock.settimeout(5)
-            self.sock.connect((self.target_ip, 65432))
-            self.sock.settimeout(None)
+            self.session_token = None
+            self.frame_seq = None
+            self.framebuffer = None
+            self.open_socket('HELLO')
+            self.file_sender = FileSender(self.mux, on_status=self.on_file_status)
 
             self.connected = True
             self.connection_label.config(text=f"✅ Connected to {self.target_ip}", fg="#00ff88")
             self.connect_button.config(text="🔌 Disconnect", command=self.disconnect, state=tk.NORMAL)
+            self.send_file_button.config(state=tk.NORMAL)
 
             self.running = True
             threading.Thread(target=self.receive_data, daemon=True).start()
+            self.start_frame_transport()
             threading.Thread(target=self.ping_server, daemon=True).start()
             self.start_input_capture()
 
@@ -354,20 +558,99 @@ class RemoteClientApp:
             self.connection_label.config(text="❌ Failed", fg="#ff6666")
             self.connect_button.config(text="🔗 Connect", command=self.connect_to_host, state=tk.NORMAL)
 
+    def open_socket(self, greeting):
+        """Connect and open the session with HELLO or RESUME"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        limit_unsent(sock)  # File transfers go out on this socket, ahead of input
+        sock.settimeout(5)
+        try:
+            sock.connect((self.target_ip, 65432))
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(None)
+        self.sock = sock
+        self.mux = MuxConnection(sock, stats=self.stats, bulk_rate=BULK_RATE_LIMIT)
+        self.mux.send_text(CONTROL, greeting)
+
+    def reconnect(self):
+        """Resume the host session after a dropped connection; returns True on success"""
+        self.reconnecting = True
+        self.root.after(0, lambda: self.connection_label.config(text="🔄 Reconnecting...", fg="#ffaa00"))
+        self.mux.close()
+        try:
+            self.sock.close()
+        except:
+            pass
+        if self.udp_sock:
+            try:
+                self.udp_sock.close()
+            except:
+                pass
+            self.udp_sock = None
+
+        deadline = time.time() + RESUME_GRACE
+        while self.running and time.time() < deadline:
+            try:
+                # The framebuffer is kept, so the host only has to send what changed since
+                seq = self.frame_seq if self.frame_seq is not None else ''
+                self.open_socket(f"RESUME|{self.session_token}|{seq}")
+                break
+            except OSError:
+                time.sleep(RECONNECT_DELAY)
+        else:
+            self.reconnecting = False
+            return False
+
+        self.stats.add('reconnects')
+        if self.file_sender:
+            self.file_sender.attach(self.mux)
+        self.start_frame_transport()
+        self.reconnecting = False
+        self.root.after(0, lambda: self.connection_label.config(text=f"✅ Connected to {self.target_ip}", fg="#00ff88"))
+        return True
+
     def disconnect(self):
         """Disconnect from host"""
         def _disconnect():
             self.running = False
             self.connected = False
-
+            self.session_token = None
+            self.framebuffer = None
+            self.zoom_index = 0
+            self.view = None
+            self.frame_view = None
+            self.cursor_updates = False
+            self.frame_size = None
+
+            if self.mux:
+                try:
+                    # Tell the host not to hold the session for a resume
+                    self.mux.send_text(CONTROL, 'BYE')
+                    self.mux.flush(0.5)
+                except:
+                    pass
+                self.mux.close()
+                self.mux = None
+            self.file_sender = None
+            self.shm_reader = None
+            self.shm_name = None
             if self.sock:
                 try:
                     self.sock.close()
                 except:
                     pass
                 self.sock = None
+            if self.udp_sock:
+                try:
+                    self.udp_sock.close()
+                except:
+                    pass
+                self.udp_sock = None
 
             self.stop_input_capture()
+            self.stop_recording()
             self.show_client_cursor()
             self.canvas.delete("all")
 
@@ -376,6 +659,7 @@ class RemoteClientApp:
 
             self.connection_label.config(text="❌ Disconnected", fg="#888")
             self.connect_button.config(text="🔗 Connect", command=self.connect_to_host, state=tk.NORMAL)
+            self.send_file_button.config(state=tk.DISABLED)
             self.perf_label.config(text="FPS: -- | Latency: -- ms")
 
         if threading.current_thread() is threading.main_thread():
@@ -385,84 +669,291 @@ class RemoteClientApp:
 
     def receive_data(self):
         """Receive and process data - FIXED VERSION"""
-        data = b""
-        payload_size = struct.calcsize(">L")
+        while self.running:
+            try:
+                channel, payload = self.mux.recv()
+            except Exception as e:
+                if not self.running:
+                    break
+                print(f"Data receive error: {e}")
+                if self.session_token and self.reconnect():
+                    continue
+                break
+
+            # A bad message is skipped; only a failed recv means the link is gone
+            try:
+                if channel == VIDEO:
+                    self.receive_packet(payload)
+
+                elif channel == CURSOR:
+                    self.update_cursor(pickle.loads(payload))
+
+                elif channel == CONTROL:
+                    self.handle_control(payload.decode('utf-8'))
+
+            except Exception as e:
+                print(f"Message processing error: {e}")
+
+        self.root.after(0, self.disconnect)
 
+    def update_cursor(self, cursor):
+        """Apply a cursor update, caching the shape image the first time it arrives"""
+        self.remote_mouse_pos = (cursor['x'], cursor['y'])
+        self.remote_mouse_visible = cursor['visible']
+        shape_id = cursor.get('shape')
+        if 'image' in cursor and shape_id not in self.cursor_shapes:
+            bgra = cv2.imdecode(np.frombuffer(cursor['image'], np.uint8), cv2.IMREAD_UNCHANGED)
+            if bgra is not None and bgra.ndim == 3 and bgra.shape[2] == 4:
+                image = Image.fromarray(cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGBA))
+                self.cursor_shapes[shape_id] = (image, tuple(cursor['hotspot']))
+                self.stats.add('cursor_shapes')
+        self.remote_cursor_shape = shape_id
+        self.cursor_updates = True
+        if not self.cursor_redraw_pending:
+            self.cursor_redraw_pending = True
+            self.root.after(0, self.draw_cursor)
+
+    def handle_control(self, line):
+        """Handle a control-channel message from the host"""
+        cmd, _, arg = line.partition('|')
+        if cmd == 'PONG':
+            self.latency = (time.time() - self.last_ping_time) * 1000
+        elif cmd == 'SESSION':
+            token, _, resumed = arg.partition('|')
+            self.session_token = token
+            if resumed == '1':
+                print("Session resumed")
+            else:
+                # A new host session: any old segment is dead, frames come over TCP until SHM
+                self.shm_reader = None
+                self.shm_name = None
+        elif cmd == 'STATS':
+            self.host_stats = json.loads(arg)
+        elif cmd == 'SHM':
+            if arg != self.shm_name:
+                # A new segment replaces the old reader, whose loop then exits
+                self.shm_name = arg
+                self.shm_reader = None
+                threading.Thread(target=self.receive_shm, args=(arg,), daemon=True).start()
+        elif cmd.startswith('FILE_') and self.file_sender:
+            self.file_sender.handle_control(cmd, arg)
+
+    def send_file(self):
+        """Stream a file to the host over the bulk channel"""
+        if not self.connected or not self.file_sender:
+            return
+        if self.fullscreen:
+            self.exit_fullscreen()
+        path = filedialog.askopenfilename(title="Send File to Host")
+        if not path:
+            return
+        try:
+            self.file_sender.offer(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not send file:\n{str(e)}")
+
+    def on_file_status(self, name, text):
+        """Show file transfer progress in the status bar"""
+        self.root.after(0, lambda: self.connection_label.config(text=f"📤 {name}: {text}", fg="#ffaa00"))
+
+    def start_frame_transport(self):
+        """Ask for frames over shared memory (same machine) or UDP instead of the TCP stream"""
+        if SHM_LOCAL and self.target_ip in ('127.0.0.1', 'localhost', '::1'):
+            self.mux.send_text(CONTROL, 'SHM')
+        elif self.udp_var.get():
+            self.start_udp()
+
+    def start_udp(self):
+        """Ask the host to send frames over UDP; input and PINGs stay on TCP"""
+        try:
+            self.udp_sock = open_udp_socket()
+            port = self.udp_sock.getsockname()[1]
+            self.mux.send_text(CONTROL, f"UDP|{port}|{UDP_FEC_GROUP}")
+            source = self.sock.getpeername()[0]
+            threading.Thread(target=self.receive_udp, args=(self.udp_sock, source), daemon=True).start()
+        except Exception as e:
+            print(f"UDP setup failed, staying on TCP: {e}")
+
+    def receive_udp(self, udp_sock, source):
+        """Receive UDP frames from the host's address, dropping incomplete ones"""
+        # Frames are unpickled, so datagrams from any other address are discarded
+        receiver = UdpFrameReceiver(udp_sock, source, on_loss=self.request_keyframe, stats=self.stats, loss=UDP_LOSS)
         while self.running:
             try:
-                # Get message size
-                while len(data) < payload_size:
-                    packet = self.sock.recv(4096)
-                    if not packet:
-                        raise ConnectionError("Server disconnected")
-                    data += packet
-
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack(">L", packed_msg_size)[0]
-
-                # Get message data
-                while len(data) < msg_size:
-                    packet = self.sock.recv(4096)
-                    if not packet:
-                        raise ConnectionError("Server disconnected")
-                    data += packet
-
-                frame_data = data[:msg_size]
-                data = data[msg_size:]
-
-                # Process the packet
-                try:
-                    packet_info = pickle.loads(frame_data)
-                    
-                    # Update mouse info
+                frame_data = receiver.read()
+                self.stats.add('frames_received')
+                self.receive_packet(frame_data)
+            except Exception as e:
+                if self.running:
+                    print(f"UDP receive error: {e}")
+                break
+
+    def receive_shm(self, name):
+        """Render frames the host publishes in shared memory, scaling them in place"""
+        try:
+            reader = ShmFrameReader(name)
+        except Exception as e:
+            print(f"Shared memory unavailable: {e}")
+            return
+        if self.shm_name != name:
+            reader.close()  # Superseded while we were mapping it
+            return
+        self.shm_reader = reader
+        print(f"Receiving frames from shared memory {name}")
+
+        while self.running and self.shm_reader is reader:
+            try:
+                frame = reader.read(timeout=0.5)
+                if frame is None:
+                    continue
+                t = time.perf_counter()
+                seq, packet_info, pixels = frame
+                del frame
+                self.stats.add('frames_received')
+
+                if not self.cursor_updates:
                     self.remote_mouse_pos = (packet_info['mouse_x'], packet_info['mouse_y'])
                     self.remote_mouse_visible = packet_info['mouse_visible']
-                    self.remote_width = packet_info['screen_width']
-                    self.remote_height = packet_info['screen_height']
-                    
-                    # Process screen frame
-                    frame = cv2.imdecode(packet_info['screen'], cv2.IMREAD_COLOR)
-                    if frame is not None:
-                        self.process_frame(frame)
-                        
-                except Exception as e:
-                    print(f"Packet processing error: {e}")
-                    continue
+                self.remote_width = packet_info['screen_width']
+                self.remote_height = packet_info['screen_height']
+                self.frame_view = packet_info['view']
 
+                if self.pending_frames >= MAX_PENDING_FRAMES:
+                    self.stats.add('frames_dropped')
+                    del pixels
+                    continue
+                fitted = self.fit_frame(pixels)
+                if fitted is pixels:
+                    fitted = pixels.copy()
+                del pixels
+                self.stats.lap('resize', t)
+                if not reader.still_valid(seq):
+                    # The host lapped the ring while we were scaling
+                    self.stats.add('frames_torn')
+                    continue
+                if self.recorder:
+                    self.record_raw_frame(fitted, packet_info)
+                self.process_frame(fitted, fitted=True)
             except Exception as e:
-                print(f"Data receive error: {e}")
+                print(f"Shared memory receive error: {e}")
                 break
 
-        self.root.after(0, self.disconnect)
+        reader.close()
+        if self.shm_reader is reader:
+            self.shm_reader = None
+
+    def record_raw_frame(self, frame, packet_info):
+        """Encode a shared-memory frame so recordings look like network ones"""
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if ok:
+            packet = dict(packet_info, type='key', screen=buffer)
+            self.recorder.write(pickle.dumps(packet, pickle.HIGHEST_PROTOCOL), packet_info['timestamp'])
+
+    def request_keyframe(self, seq):
+        """Ask for a fresh frame instead of waiting for retransmission"""
+        now = time.time()
+        if now - self.last_keyframe_request < KEYFRAME_REQUEST_INTERVAL:
+            return
+        self.last_keyframe_request = now
+        try:
+            self.mux.send_text(CONTROL, 'KEYFRAME')
+            self.stats.add('keyframe_requests')
+        except:
+            pass
 
-    def process_frame(self, frame):
+    def receive_packet(self, frame_data):
+        """Render an encoded packet, then tee it to the recorder"""
+        kind = self.handle_packet(frame_data)
+        recorder = self.recorder
+        if recorder and kind:
+            recorder.write(frame_data, keyframe=kind == 'key')
+
+    def handle_packet(self, frame_data):
+        """Decode and render one encoded packet from the host or a recording; returns its type"""
+        try:
+            t = time.perf_counter()
+            packet_info = pickle.loads(frame_data)
+            kind = packet_info.get('type', 'key')
+            
+            # Capture-time mouse info, unless the cursor channel has a fresher position
+            if not self.cursor_updates:
+                self.remote_mouse_pos = (packet_info['mouse_x'], packet_info['mouse_y'])
+                self.remote_mouse_visible = packet_info['mouse_visible']
+            self.remote_width = packet_info['screen_width']
+            self.remote_height = packet_info['screen_height']
+            self.frame_view = packet_info.get('view')
+            
+            # Process screen frame
+            if kind == 'delta':
+                frame = self.apply_delta(packet_info)
+            else:
+                frame = cv2.imdecode(packet_info['screen'], cv2.IMREAD_COLOR)
+                self.framebuffer = frame
+            self.stats.lap('decode', t)
+            if frame is None:
+                self.stats.add('frames_dropped')
+                return kind
+            self.frame_seq = packet_info.get('seq')
+
+            # Drop instead of queueing when the Tk thread falls behind
+            if self.pending_frames >= MAX_PENDING_FRAMES:
+                self.stats.add('frames_dropped')
+                return kind
+            self.process_frame(frame)
+            return kind
+                
+        except Exception as e:
+            self.stats.add('frames_dropped')
+            print(f"Packet processing error: {e}")
+
+    def apply_delta(self, packet_info):
+        """Paint changed tiles onto the framebuffer they were diffed against"""
+        frame = self.framebuffer
+        if frame is None or packet_info['base'] != self.frame_seq:
+            # Not the frame the host diffed against; wait for a full one
+            self.request_keyframe(packet_info.get('seq'))
+            return None
+        for x, y, buffer in packet_info['tiles']:
+            tile = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            if tile is not None:
+                th, tw = tile.shape[:2]
+                frame[y:y + th, x:x + tw] = tile
+        return frame
+
+    def fit_frame(self, frame):
+        """Scale a frame to the screen in fullscreen, or to fit the canvas"""
+        if self.fullscreen:
+            screen_width = self.root.winfo_screenwidth()
+            screen_height = self.root.winfo_screenheight()
+            return cv2.resize(frame, (screen_width, screen_height), interpolation=cv2.INTER_LINEAR)
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        if canvas_width > 1 and canvas_height > 1:
+            h, w = frame.shape[:2]
+            scale = min(canvas_width / w, canvas_height / h)
+            new_w, new_h = int(w * scale), int(h * scale)
+            if new_w > 0 and new_h > 0:
+                return cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def process_frame(self, frame, fitted=False):
         """Process and display frame"""
         try:
+            t = time.perf_counter()
+
             # Resize frame
-            if self.fullscreen:
-                screen_width = self.root.winfo_screenwidth()
-                screen_height = self.root.winfo_screenheight()
-                frame = cv2.resize(frame, (screen_width, screen_height), interpolation=cv2.INTER_LINEAR)
-            else:
-                canvas_width = self.canvas.winfo_width()
-                canvas_height = self.canvas.winfo_height()
-                if canvas_width > 1 and canvas_height > 1:
-                    h, w = frame.shape[:2]
-                    scale = min(canvas_width / w, canvas_height / h)
-                    new_w, new_h = int(w * scale), int(h * scale)
-                    if new_w > 0 and new_h > 0:
-                        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            if not fitted:
+                frame = self.fit_frame(frame)
+                t = self.stats.lap('resize', t)
 
             # Convert to RGB
             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             img = Image.fromarray(frame)
-            
-            # Add cursor overlay
-            if self.cursor_var.get() and self.show_remote_cursor:
-                img = self.add_cursor_overlay(img)
-            
             imgtk = ImageTk.PhotoImage(image=img)
+            self.stats.lap('pil', t)
+
+            self.pending_frames += 1
+            self.stats.set_gauge('canvas_queue', self.pending_frames)
             self.root.after(0, self.update_canvas, imgtk)
             
             # Update FPS
@@ -474,27 +965,33 @@ class RemoteClientApp:
         except Exception as e:
             print(f"Frame processing error: {e}")
 
-    def add_cursor_overlay(self, img):
-        """Add remote cursor overlay"""
-        if not self.remote_mouse_visible:
-            return img
-            
-        # Calculate cursor position
-        if self.fullscreen:
-            screen_width = self.root.winfo_screenwidth()
-            screen_height = self.root.winfo_screenheight()
-            cursor_x = int((self.remote_mouse_pos[0] / self.remote_width) * screen_width)
-            cursor_y = int((self.remote_mouse_pos[1] / self.remote_height) * screen_height)
-        else:
-            img_width, img_height = img.size
-            cursor_x = int((self.remote_mouse_pos[0] / self.remote_width) * img_width)
-            cursor_y = int((self.remote_mouse_pos[1] / self.remote_height) * img_height)
-        
-        # Draw cursor
-        draw = ImageDraw.Draw(img)
+    def draw_cursor(self):
+        """Draw the remote cursor as its own canvas item, so it moves without a new frame"""
+        self.cursor_redraw_pending = False
+        self.canvas.delete("cursor")
+        if not (self.remote_mouse_visible and self.cursor_var.get() and self.show_remote_cursor):
+            return
+        if self.frame_size is None:
+            return
+
+        # Calculate cursor position within the (possibly zoomed) view
+        vx, vy, vw, vh = self.view_rect()
+        frame_x, frame_y = self.frame_origin
+        frame_width, frame_height = self.frame_size
+        cursor_x = frame_x + int(((self.remote_mouse_pos[0] - vx) / vw) * frame_width)
+        cursor_y = frame_y + int(((self.remote_mouse_pos[1] - vy) / vh) * frame_height)
+
+        # Draw the host's real cursor when we have its shape, scaled like the frame
+        shape = self.scaled_cursor(self.remote_cursor_shape, frame_width / vw)
+        if shape:
+            image, (hotspot_x, hotspot_y) = shape
+            self.canvas.create_image(cursor_x - hotspot_x, cursor_y - hotspot_y, anchor=tk.NW,
+                                     image=image, tags="cursor")
+            self.canvas.cursor_image = image
+            return
+
+        # Fallback arrow
         cursor_size = 16
-        
-        # Cursor arrow shape
         points = [
             (cursor_x, cursor_y),
             (cursor_x, cursor_y + cursor_size),
@@ -502,47 +999,113 @@ class RemoteClientApp:
             (cursor_x + cursor_size//2, cursor_y + cursor_size//2),
             (cursor_x + cursor_size, cursor_y)
         ]
-        
-        # Draw with white fill and black outline
-        draw.polygon(points, fill='white', outline='black', width=2)
-        
-        return img
+        self.canvas.create_polygon(points, fill='white', outline='black', width=2, tags="cursor")
+
+    def scaled_cursor(self, shape_id, scale):
+        """Cached cursor shape and hotspot resized by the display scale; Tk thread only"""
+        shape = self.cursor_shapes.get(shape_id)
+        if shape is None:
+            return None
+        scale = round(scale, 2)
+        key = (shape_id, scale)
+        scaled = self.scaled_cursor_cache.get(key)
+        if scaled is None:
+            image, (hotspot_x, hotspot_y) = shape
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            scaled = (ImageTk.PhotoImage(image.resize(size, Image.LANCZOS)),
+                      (round(hotspot_x * scale), round(hotspot_y * scale)))
+            if len(self.scaled_cursor_cache) >= 64:
+                self.scaled_cursor_cache.clear()  # Window resizes leave stale scales behind
+            self.scaled_cursor_cache[key] = scaled
+        return scaled
 
     def update_canvas(self, imgtk):
         """Update canvas with image"""
+        t = time.perf_counter()
+        self.pending_frames = max(0, self.pending_frames - 1)
         self.canvas.delete("all")
         if self.fullscreen:
-            self.canvas.create_image(0, 0, anchor=tk.NW, image=imgtk)
+            x, y = 0, 0
         else:
             cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
-            iw, ih = imgtk.width(), imgtk.height()
-            x, y = (cw - iw) // 2, (ch - ih) // 2
-            self.canvas.create_image(x, y, anchor=tk.NW, image=imgtk)
+            x, y = (cw - imgtk.width()) // 2, (ch - imgtk.height()) // 2
+        self.canvas.create_image(x, y, anchor=tk.NW, image=imgtk)
         self.canvas.image = imgtk
+        self.frame_origin = (x, y)
+        self.frame_size = (imgtk.width(), imgtk.height())
+        self.draw_cursor()
+        if self.show_stats_overlay and self.stats_overlay_text:
+            self.draw_stats_overlay()
+        self.stats.lap('canvas', t)
+
+    def draw_stats_overlay(self):
+        """Draw pipeline stats in the top-left corner of the canvas"""
+        self.canvas.delete("stats")
+        text_id = self.canvas.create_text(12, 12, anchor=tk.NW, text=self.stats_overlay_text,
+                                          fill="#00ff88", font=("Consolas", 9), tags="stats")
+        x1, y1, x2, y2 = self.canvas.bbox(text_id)
+        bg_id = self.canvas.create_rectangle(x1 - 6, y1 - 4, x2 + 6, y2 + 4, fill="#000000",
+                                             outline="#333", tags="stats")
+        self.canvas.tag_lower(bg_id, text_id)
 
     def ping_server(self):
         """Send pings to measure latency"""
         while self.running:
             try:
                 self.last_ping_time = time.time()
-                self.sock.sendall(b'PING\n')
-                time.sleep(1.0)
+                self.mux.send_text(CONTROL, 'PING')
+                if self.show_stats_overlay:
+                    self.mux.send_text(CONTROL, 'STATS')
             except:
-                break
+                if not self.reconnecting:
+                    break
+            time.sleep(1.0)
 
     def monitor_performance(self):
         """Monitor performance"""
+        last_counters = {}
         while True:
-            if self.connected:
+            if self.connected or self.replaying:
+                snapshot = self.stats.snapshot()
+                counters = snapshot['counters']
+                stages = snapshot['stages']
+                delta = {k: v - last_counters.get(k, 0) for k, v in counters.items()}
+                last_counters = counters
+
                 fps_text = f"FPS: {self.fps:.1f}"
                 latency_text = f"Latency: {self.latency:.0f}ms"
-                self.root.after(0, self.update_performance_display, f"{fps_text} | {latency_text}")
+                mbps = delta.get('bytes_received', 0) * 8 / 1e6
+                decode_ms = stages.get('decode', {}).get('p95_ms', 0.0)
+                dropped = delta.get('frames_dropped', 0)
+                text = (f"{fps_text} | {latency_text} | {mbps:.1f} Mbps | "
+                        f"Decode p95: {decode_ms:.1f}ms | Dropped: {dropped}/s")
+                if self.frame_view:
+                    text += f" | Zoom {ZOOM_LEVELS[self.zoom_index]:g}x"
+
+                lines = [text, f"Canvas queue: {snapshot['gauges'].get('canvas_queue', 0)}"]
+                for stage in ('recv', 'decode', 'resize', 'pil', 'canvas'):
+                    if stage in stages:
+                        h = stages[stage]
+                        lines.append(f"{stage:<7} p50 {h['p50_ms']:6.2f}  p95 {h['p95_ms']:6.2f}  "
+                                     f"max {h['max_ms']:7.2f} ms")
+                if self.host_stats and self.connected:
+                    host_stages = self.host_stats.get('stages', {})
+                    lines.append("host")
+                    for stage in ('grab', 'convert', 'encode', 'serialize', 'socket_write'):
+                        if stage in host_stages:
+                            h = host_stages[stage]
+                            lines.append(f"{stage:<12} p50 {h['p50_ms']:6.2f}  p95 {h['p95_ms']:6.2f} ms")
+                self.stats_overlay_text = "\n".join(lines)
+
+                self.root.after(0, self.update_performance_display, text)
             time.sleep(1.0)
 
     def update_performance_display(self, text):
         """Update performance display"""
         if hasattr(self, 'perf_label'):
             self.perf_label.config(text=text)
+        if self.show_stats_overlay:
+            self.draw_stats_overlay()
 
     def start_input_capture(self):
         """Start input capture"""
@@ -550,12 +1113,14 @@ class RemoteClientApp:
             self.stop_input_capture()
 
         def safe_send(data):
-            if not self.connected or not self.sock:
+            if not self.connected or not self.mux:
                 return False
             try:
-                self.sock.sendall((data + '\n').encode('utf-8'))
+                self.mux.send_text(INPUT, data)
                 return True
             except Exception as e:
+                if self.reconnecting or self.session_token:
+                    return False  # receive_data is resuming the session
                 print(f"Input send failed: {e}")
                 self.root.after(0, self.disconnect)
                 return False
@@ -570,11 +1135,20 @@ class RemoteClientApp:
             xr = x / screen_width
             yr = y / screen_height
 
-            target_x = int(xr * self.remote_width)
-            target_y = int(yr * self.remote_height)
+            # Map through the view the displayed frame shows
+            vx, vy, vw, vh = self.view_rect()
+            target_x = int(vx + xr * vw)
+            target_y = int(vy + yr * vh)
 
             safe_send(f"MOVE|{target_x}|{target_y}")
 
+            # Pushing against an edge pans a zoomed view
+            if self.view:
+                dx = -PAN_STEP if xr < EDGE_PAN else PAN_STEP if xr > 1 - EDGE_PAN else 0
+                dy = -PAN_STEP if yr < EDGE_PAN else PAN_STEP if yr > 1 - EDGE_PAN else 0
+                if (dx or dy) and self.view == self.frame_view:
+                    self.pan_view(dx, dy)
+
         def on_click(x, y, button, pressed):
             if not self.fullscreen or not self.connected:
                 return
@@ -593,7 +1167,7 @@ class RemoteClientApp:
                 k = str(key).replace("'", "")
                 if k.startswith('Key.'):
                     k = k[4:]
-                if k in ('f11', 'escape'):
+                if k in LOCAL_KEYS:
                     return
                 safe_send(f"KEY|{k}|press")
             except Exception as e:
@@ -606,7 +1180,7 @@ class RemoteClientApp:
                 k = str(key).replace("'", "")
                 if k.startswith('Key.'):
                     k = k[4:]
-                if k in ('f11', 'escape'):
+                if k in LOCAL_KEYS:
                     return
                 safe_send(f"KEY|{k}|release")
             except Exception as e:
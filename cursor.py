@@ -0,0 +1,185 @@
+# cursor.py — HOST CURSOR STATE AND SHAPES
+# Reads the real system cursor (position, visibility, handle) and renders each distinct
+# cursor shape once into a PNG with its hotspot.
+#
+# Shapes are identified by a hash of their pixels, so the I-beam is the same id in every
+# session and the cursor channel only carries the image the first time a client sees it:
+#   {'x', 'y', 'visible', 'shape': <id>}                            (known shape)
+#   {'x', 'y', 'visible', 'shape': <id>, 'image': <png>, 'hotspot'}  (first use)
+
+import ctypes
+import hashlib
+import threading
+from ctypes import wintypes, Structure
+
+import cv2
+import numpy as np
+
+user32 = ctypes.WinDLL('user32', use_last_error=True)
+gdi32 = ctypes.WinDLL('gdi32', use_last_error=True)
+
+CURSOR_SHOWING = 0x00000001
+DI_NORMAL = 0x0003
+DIB_RGB_COLORS = 0
+
+class POINT(Structure):
+    _fields_ = [("x", ctypes.c_long), ("y", ctypes.c_long)]
+
+class CURSORINFO(Structure):
+    _fields_ = [("cbSize", wintypes.DWORD), ("flags", wintypes.DWORD),
+                ("hCursor", ctypes.c_void_p), ("ptScreenPos", POINT)]
+
+class ICONINFO(Structure):
+    _fields_ = [("fIcon", wintypes.BOOL), ("xHotspot", wintypes.DWORD), ("yHotspot", wintypes.DWORD),
+                ("hbmMask", ctypes.c_void_p), ("hbmColor", ctypes.c_void_p)]
+
+class BITMAP(Structure):
+    _fields_ = [("bmType", ctypes.c_long), ("bmWidth", ctypes.c_long), ("bmHeight", ctypes.c_long),
+                ("bmWidthBytes", ctypes.c_long), ("bmPlanes", wintypes.WORD),
+                ("bmBitsPixel", wintypes.WORD), ("bmBits", ctypes.c_void_p)]
+
+class BITMAPINFOHEADER(Structure):
+    _fields_ = [("biSize", wintypes.DWORD), ("biWidth", ctypes.c_long), ("biHeight", ctypes.c_long),
+                ("biPlanes", wintypes.WORD), ("biBitCount", wintypes.WORD),
+                ("biCompression", wintypes.DWORD), ("biSizeImage", wintypes.DWORD),
+                ("biXPelsPerMeter", ctypes.c_long), ("biYPelsPerMeter", ctypes.c_long),
+                ("biClrUsed", wintypes.DWORD), ("biClrImportant", wintypes.DWORD)]
+
+GetCursorInfo = user32.GetCursorInfo
+GetCursorInfo.argtypes = [ctypes.POINTER(CURSORINFO)]
+GetCursorInfo.restype = wintypes.BOOL
+GetIconInfo = user32.GetIconInfo
+GetIconInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(ICONINFO)]
+GetIconInfo.restype = wintypes.BOOL
+DrawIconEx = user32.DrawIconEx
+DrawIconEx.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                       ctypes.c_int, ctypes.c_int, wintypes.UINT, ctypes.c_void_p, wintypes.UINT]
+DrawIconEx.restype = wintypes.BOOL
+GetDC = user32.GetDC
+GetDC.argtypes = [ctypes.c_void_p]
+GetDC.restype = ctypes.c_void_p
+ReleaseDC = user32.ReleaseDC
+ReleaseDC.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+
+GetObject = gdi32.GetObjectW
+GetObject.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+CreateCompatibleDC = gdi32.CreateCompatibleDC
+CreateCompatibleDC.argtypes = [ctypes.c_void_p]
+CreateCompatibleDC.restype = ctypes.c_void_p
+CreateDIBSection = gdi32.CreateDIBSection
+CreateDIBSection.argtypes = [ctypes.c_void_p, ctypes.POINTER(BITMAPINFOHEADER), wintypes.UINT,
+                             ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p, wintypes.DWORD]
+CreateDIBSection.restype = ctypes.c_void_p
+SelectObject = gdi32.SelectObject
+SelectObject.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+SelectObject.restype = ctypes.c_void_p
+DeleteObject = gdi32.DeleteObject
+DeleteObject.argtypes = [ctypes.c_void_p]
+DeleteDC = gdi32.DeleteDC
+DeleteDC.argtypes = [ctypes.c_void_p]
+
+def read_cursor():
+    """Current cursor as (x, y, visible, handle); handle is None when it cannot be read"""
+    info = CURSORINFO()
+    info.cbSize = ctypes.sizeof(CURSORINFO)
+    try:
+        if GetCursorInfo(ctypes.byref(info)):
+            return (info.ptScreenPos.x, info.ptScreenPos.y,
+                    bool(info.flags & CURSOR_SHOWING), info.hCursor)
+    except Exception:
+        pass
+    return (0, 0, True, None)
+
+def draw_cursor(handle, width, height, fill):
+    """Draw a cursor onto a solid background; returns an (h, w, 4) BGRA array"""
+    screen_dc = GetDC(None)
+    dc = CreateCompatibleDC(screen_dc)
+    header = BITMAPINFOHEADER(biSize=ctypes.sizeof(BITMAPINFOHEADER), biWidth=width, biHeight=-height,
+                              biPlanes=1, biBitCount=32)
+    bits = ctypes.c_void_p()
+    dib = CreateDIBSection(dc, ctypes.byref(header), DIB_RGB_COLORS, ctypes.byref(bits), None, 0)
+    old = SelectObject(dc, dib)
+    try:
+        ctypes.memset(bits, fill, width * height * 4)
+        DrawIconEx(dc, 0, 0, handle, width, height, 0, None, DI_NORMAL)
+        return np.frombuffer(ctypes.string_at(bits, width * height * 4), np.uint8).reshape(height, width, 4).copy()
+    finally:
+        SelectObject(dc, old)
+        DeleteObject(dib)
+        DeleteDC(dc)
+        ReleaseDC(None, screen_dc)
+
+def render_cursor(handle):
+    """Render a cursor handle to (BGRA image, hotspot), or None"""
+    icon = ICONINFO()
+    if not GetIconInfo(handle, ctypes.byref(icon)):
+        return None
+    try:
+        bitmap = BITMAP()
+        GetObject(icon.hbmColor or icon.hbmMask, ctypes.sizeof(BITMAP), ctypes.byref(bitmap))
+        width, height = bitmap.bmWidth, bitmap.bmHeight
+        if not icon.hbmColor:
+            height //= 2  # Monochrome cursors stack the AND and XOR masks
+        hotspot = (icon.xHotspot, icon.yHotspot)
+    finally:
+        if icon.hbmMask:
+            DeleteObject(icon.hbmMask)
+        if icon.hbmColor:
+            DeleteObject(icon.hbmColor)
+    if width <= 0 or height <= 0:
+        return None
+
+    # Alpha from the difference between drawing on black and on white
+    on_black = draw_cursor(handle, width, height, 0x00)[..., :3].astype(np.float32)
+    on_white = draw_cursor(handle, width, height, 0xFF)[..., :3].astype(np.float32)
+    diff = (on_white - on_black).mean(axis=2)
+    alpha = np.clip(255 - diff, 0, 255)
+    inverted = diff < 0  # XOR pixels (e.g. the I-beam) have no fixed colour; draw them black
+    color = np.where(alpha[..., None] > 0, on_black * 255 / np.maximum(alpha[..., None], 1), 0)
+    color[inverted] = 0
+    image = np.dstack([np.clip(color, 0, 255), alpha]).astype(np.uint8)
+    return image, hotspot
+
+class CursorShape:
+    def __init__(self, shape_id, png, hotspot):
+        self.shape_id = shape_id
+        self.png = png
+        self.hotspot = hotspot
+
+class CursorShapeCache:
+    """Maps cursor handles to rendered shapes, rendering each handle once"""
+
+    def __init__(self):
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def shape_for(self, handle):
+        if not handle:
+            return None
+        with self.lock:
+            if handle in self.shapes:
+                return self.shapes[handle]
+        try:
+            rendered = render_cursor(handle)
+        except Exception:
+            rendered = None
+        shape = None
+        if rendered is not None:
+            image, hotspot = rendered
+            ok, png = cv2.imencode('.png', image)
+            if ok:
+                key = image.tobytes() + f"{hotspot}".encode('ascii')
+                shape_id = hashlib.blake2b(key, digest_size=8).hexdigest()
+                shape = CursorShape(shape_id, png.tobytes(), hotspot)
+        with self.lock:
+            self.shapes[handle] = shape
+        return shape
+
+def cursor_update(x, y, visible, shape, sent_shapes):
+    """Cursor channel message; the image is attached only the first time a shape is sent"""
+    update = {'x': x, 'y': y, 'visible': visible, 'shape': shape.shape_id if shape else None}
+    if shape and shape.shape_id not in sent_shapes:
+        update['image'] = shape.png
+        update['hotspot'] = shape.hotspot
+        sent_shapes.add(shape.shape_id)
+    return update
@@ -0,0 +1,270 @@
+# filetransfer.py — STREAMING FILE TRANSFER OVER THE BULK CHANNEL
+# Resumable, constant-memory file transfer that shares the connection with the screen stream
+#
+# Control channel:
+#   sender   -> receiver : FILE_OFFER|<id>|<size>|<name>
+#   receiver -> sender   : FILE_ACCEPT|<id>|<offset>   (offset > 0 resumes a partial file)
+#                          FILE_REJECT|<id>|<reason>
+#   sender   -> receiver : FILE_END|<id>
+#                          FILE_ERROR|<id>|<reason>     (the sender gave up; partial copy discarded)
+#   receiver -> sender   : FILE_DONE|<id>|<saved name>  or  FILE_ERROR|<id>|<reason>
+# Bulk channel, one message per chunk:
+#   [id:8 bytes][offset:u64][data]
+#
+# The sender streams straight from disk with socket.sendfile, so neither side ever holds
+# more than one chunk of the file in memory. The transfer id is derived from the file's
+# name, size and mtime, so re-offering the same file after a dropped connection resumes
+# from the receiver's partial copy.
+
+import hashlib
+import os
+import struct
+import threading
+
+from protocol import OutgoingMessage, CHUNK_HEADER, FLAG_END, BULK, CONTROL, send_buffers
+
+BULK_HEADER = struct.Struct(">8sQ")
+
+def transfer_id(path):
+    """Stable id for a file: same name, size and mtime give the same id"""
+    st = os.stat(path)
+    key = f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}".encode('utf-8')
+    return hashlib.blake2b(key, digest_size=8).hexdigest()
+
+class FileStreamMessage(OutgoingMessage):
+    """Bulk-channel message stream that sends a file region with sendfile, one chunk at a time"""
+
+    def __init__(self, file, file_id, offset, size, on_progress=None, on_complete=None, on_error=None):
+        self.file = file
+        self.raw_id = bytes.fromhex(file_id)
+        self.offset = offset
+        self.size = size
+        self.started = False
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.on_error = on_error
+
+    def write_chunk(self, sock, channel, max_size):
+        count = min(max_size - BULK_HEADER.size, self.size - self.offset)  # Chunk stays within max_size
+        header = BULK_HEADER.pack(self.raw_id, self.offset)
+        send_buffers(sock, [CHUNK_HEADER.pack(channel, FLAG_END, BULK_HEADER.size + count), header])
+        if count:
+            sent = sock.sendfile(self.file, self.offset, count)
+            if sent < count:
+                # The file shrank under us; pad out the chunk the header promised so the
+                # stream stays framed, then abandon the transfer
+                sock.sendall(bytes(count - sent))
+                self.file.close()
+                if self.on_error:
+                    self.on_error(f"file changed during transfer ({self.offset + sent} of {self.size} bytes)")
+                return CHUNK_HEADER.size + BULK_HEADER.size + count, True
+        self.offset += count
+
+        last = self.offset >= self.size
+        if self.on_progress:
+            self.on_progress(self.offset, self.size)
+        if last:
+            self.file.close()
+            if self.on_complete:
+                self.on_complete()
+        return CHUNK_HEADER.size + BULK_HEADER.size + count, last
+
+    def close(self):
+        self.file.close()
+
+class FileSender:
+    """Offers files to the peer and streams them once accepted"""
+
+    def __init__(self, mux, on_status=None):
+        self.mux = mux
+        self.on_status = on_status  # Called with (name, text) as a transfer progresses
+        self.outgoing = {}
+        self.lock = threading.Lock()
+
+    def status(self, name, text):
+        if self.on_status:
+            self.on_status(name, text)
+
+    def offer(self, path):
+        file_id = transfer_id(path)
+        size = os.path.getsize(path)
+        name = os.path.basename(path)
+        with self.lock:
+            self.outgoing[file_id] = path
+        self.mux.send_text(CONTROL, f"FILE_OFFER|{file_id}|{size}|{name}")
+        self.status(name, "offered")
+        return file_id
+
+    def attach(self, mux):
+        """Continue on a new connection, re-offering unfinished files so they resume"""
+        self.mux = mux
+        with self.lock:
+            paths = list(self.outgoing.values())
+        for path in paths:
+            try:
+                self.offer(path)
+            except OSError as e:
+                self.status(os.path.basename(path), f"failed: {e}")
+
+    def handle_control(self, cmd, arg):
+        """Handle a FILE_* reply; returns False if cmd is not a file-transfer command"""
+        if cmd not in ('FILE_ACCEPT', 'FILE_REJECT', 'FILE_DONE', 'FILE_ERROR'):
+            return False
+        file_id, _, rest = arg.partition('|')
+        with self.lock:
+            path = self.outgoing.get(file_id)
+        if path is None:
+            return True
+        name = os.path.basename(path)
+
+        if cmd == 'FILE_ACCEPT':
+            try:
+                self.start_stream(file_id, path, int(rest))
+            except ConnectionError:
+                pass  # Link lost; attach() re-offers it on the next connection
+            except (OSError, ValueError) as e:
+                # E.g. the file was deleted after it was offered
+                self.fail(file_id, name, str(e))
+        else:
+            with self.lock:
+                self.outgoing.pop(file_id, None)
+            if cmd == 'FILE_DONE':
+                self.status(name, "done")
+            else:
+                self.status(name, f"failed: {rest}")
+        return True
+
+    def fail(self, file_id, name, reason):
+        """Abandon a transfer and tell the receiver to discard its partial copy"""
+        with self.lock:
+            self.outgoing.pop(file_id, None)
+        self.status(name, f"failed: {reason}")
+        try:
+            self.mux.send_text(CONTROL, f"FILE_ERROR|{file_id}|{reason}")
+        except ConnectionError:
+            pass
+
+    def start_stream(self, file_id, path, offset):
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        if offset > size:
+            raise ValueError(f"resume offset {offset} is past the end of the file")
+        if offset:
+            self.status(name, f"resuming at {offset * 100 // max(size, 1)}%")
+        last_pct = [-1]
+
+        def _progress(sent, total):
+            pct = sent * 100 // max(total, 1)
+            if pct != last_pct[0]:
+                last_pct[0] = pct
+                self.status(name, f"{pct}%")
+
+        message = FileStreamMessage(open(path, 'rb'), file_id, offset, size,
+                                    on_progress=_progress,
+                                    on_complete=lambda: self.mux.send_text(CONTROL, f"FILE_END|{file_id}"),
+                                    on_error=lambda reason: self.fail(file_id, name, reason))
+        try:
+            self.mux.send(BULK, message)
+        except ConnectionError:
+            message.file.close()
+            raise
+
+class IncomingFile:
+    def __init__(self, file_id, name, size, part_path):
+        self.file_id = file_id
+        self.name = name
+        self.size = size
+        self.part_path = part_path
+        self.file = open(part_path, 'ab')
+        self.received = self.file.tell()
+
+class FileReceiver:
+    """Accepts offered files into a directory, resuming partial copies"""
+
+    def __init__(self, mux, directory, on_status=None):
+        self.mux = mux
+        self.directory = directory
+        self.on_status = on_status
+        self.incoming = {}
+
+    def status(self, name, text):
+        if self.on_status:
+            self.on_status(name, text)
+
+    def handle_control(self, cmd, arg):
+        """Handle a FILE_* command; returns False if cmd is not a file-transfer command"""
+        if cmd == 'FILE_OFFER':
+            file_id, size, name = arg.split('|', 2)
+            name = os.path.basename(name.replace('\\', '/')) or file_id
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                bytes.fromhex(file_id)
+                part_path = os.path.join(self.directory, f"{name}.{file_id}.part")
+                incoming = IncomingFile(file_id, name, int(size), part_path)
+            except (OSError, ValueError) as e:
+                self.mux.send_text(CONTROL, f"FILE_REJECT|{file_id}|{e}")
+                return True
+            if incoming.received > incoming.size:
+                incoming.file.truncate(0)
+                incoming.received = 0
+            self.incoming[file_id] = incoming
+            self.mux.send_text(CONTROL, f"FILE_ACCEPT|{file_id}|{incoming.received}")
+            self.status(name, f"receiving from {incoming.received} of {incoming.size} bytes")
+            return True
+
+        if cmd == 'FILE_END':
+            self.finish(arg.partition('|')[0])
+            return True
+
+        if cmd == 'FILE_ERROR':
+            # The sender gave up; what we have is not worth resuming
+            file_id, _, reason = arg.partition('|')
+            incoming = self.incoming.pop(file_id, None)
+            if incoming is not None:
+                incoming.file.close()
+                try:
+                    os.remove(incoming.part_path)
+                except OSError:
+                    pass
+                self.status(incoming.name, f"failed: {reason}")
+            return True
+        return False
+
+    def handle_bulk(self, payload):
+        """Write one bulk chunk straight to disk"""
+        raw_id, offset = BULK_HEADER.unpack_from(payload)
+        incoming = self.incoming.get(raw_id.hex())
+        if incoming is None:
+            return
+        if offset != incoming.received:
+            # Out of step (e.g. a stale stream from before a resume); the sender will re-offer
+            return
+        data = memoryview(payload)[BULK_HEADER.size:]
+        incoming.file.write(data)
+        incoming.received += len(data)
+
+    def finish(self, file_id):
+        incoming = self.incoming.pop(file_id, None)
+        if incoming is None:
+            return
+        incoming.file.close()
+        if incoming.received != incoming.size:
+            self.mux.send_text(CONTROL, f"FILE_ERROR|{file_id}|got {incoming.received} of {incoming.size} bytes")
+            self.status(incoming.name, "incomplete")
+            return
+
+        final_path = os.path.join(self.directory, incoming.name)
+        base, ext = os.path.splitext(final_path)
+        n = 1
+        while os.path.exists(final_path):
+            final_path = f"{base} ({n}){ext}"
+            n += 1
+        os.replace(incoming.part_path, final_path)
+        self.mux.send_text(CONTROL, f"FILE_DONE|{file_id}|{os.path.basename(final_path)}")
+        self.status(incoming.name, f"saved to {final_path}")
+
+    def close(self):
+        """Keep partial files for resume but release their handles"""
+        for incoming in self.incoming.values():
+            incoming.file.close()
+        self.incoming.clear()
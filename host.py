@@ -3,16 +3,23 @@
 
 import socket
 import threading
-import struct
-import pickle
-import cv2
-import numpy as np
+import json
+import secrets
 from mss import mss
 import time
 
+from recording import SessionRecorder, recording_path
+from stats import PipelineStats
+from udp_transport import UdpFrameSender, open_udp_socket
+from capture import FrameEncoder, clamp_view, encode_delta, serialize
+from protocol import MuxConnection, VIDEO, CURSOR, INPUT, CONTROL, BULK
+from filetransfer import FileReceiver
+from cursor import CursorShapeCache, cursor_update, read_cursor
+from shm_transport import ShmFrameWriter
+
 # WinAPI for instant mouse movement and cursor management
 import ctypes
-from ctypes import wintypes, Structure
+from ctypes import wintypes
 user32 = ctypes.WinDLL('user32', use_last_error=True)
 
 # Mouse position and cursor functions
@@ -20,25 +27,92 @@ SetCursorPos = user32.SetCursorPos
 SetCursorPos.argtypes = [wintypes.INT, wintypes.INT]
 SetCursorPos.restype = wintypes.BOOL
 
-GetCursorPos = user32.GetCursorPos
 ShowCursor = user32.ShowCursor
 ShowCursor.argtypes = [wintypes.BOOL]
 
-# Cursor position structure
-class POINT(Structure):
-    _fields_ = [("x", ctypes.c_long), ("y", ctypes.c_long)]
-
 HOST = '0.0.0.0'
 PORT = 65432
+RECORD_DIR = None  # Set to a directory to record every session for audit
+STATS_PORT = 65433  # Local JSON stats endpoint, None to disable
+STATS_LOG = None  # Set to a file path for a periodic JSON stats log
+CURSOR_HZ = 60  # Cursor position updates per second on the cursor channel
+RECEIVE_DIR = "received_files"  # Where files pushed from clients are saved
+RESUME_GRACE = 30.0  # Seconds a dropped session keeps its pipeline for a RESUME
+HANDSHAKE_TIMEOUT = 5.0
+ZOOM_QUALITY = 80  # JPEG quality while streaming a zoomed region
+
+stats = PipelineStats("host")
+connections = set()
+connections_lock = threading.Lock()
+cursor_shapes = CursorShapeCache()  # Shared by all sessions: shapes are rendered once per host
+sessions = {}
+sessions_lock = threading.Lock()
 
 class Connection:
-    def __init__(self, sock, addr):
-        self.sock = sock
+    """A viewer session; its pipeline outlives a dropped socket for RESUME_GRACE seconds"""
+
+    def __init__(self, addr):
+        self.token = secrets.token_hex(16)
         self.addr = addr
         self.active = True
+        self.attached = threading.Event()
+        self.detached_at = time.time()
+        self.sock = None
+        self.mux = None
+        self.files = None
         self.last_mouse_pos = (0, 0)
         self.mouse_visible = True
+        self.cursor_shapes_sent = set()  # Shape ids this session's client has cached
         self.remote_controlling = False
+        self.last_activity = time.time()
+        self.recorder = None
+        self.udp_sock = None
+        self.udp_sender = None  # Frames go over UDP once the client asks for it
+        self.keyframe_event = threading.Event()
+        self.view = None  # Requested (x, y, w, h) region of the monitor, None = whole screen
+        self.shm_requested = False
+        self.shm_writer = None  # Frames go to shared memory once a local client asks for it
+
+        self.encoder = FrameEncoder()
+        self.resume_base = None  # Frame to send a delta against after a resume
+        self.last_keyframe = None  # Latest full frame packet, repainted on resume
+
+    def attach(self, sock, addr, mux):
+        """Bind a (new) socket to this session, taking over from any old one"""
+        if self.mux is not None and self.mux is not mux:
+            self.detach(self.mux)
+        self.sock = sock
+        self.addr = addr
+        self.mux = mux
+        self.files = FileReceiver(mux, RECEIVE_DIR,
+                                  on_status=lambda name, text: print(f"[Server Files] {name}: {text}"))
+        self.cursor_shapes_sent.clear()  # A shape may have been lost with the old socket
+        self.attached.set()
+
+    def detach(self, mux):
+        """Drop the socket behind mux but keep the pipeline for a resume"""
+        if self.mux is not mux:
+            return  # Already taken over by a newer connection
+        self.attached.clear()
+        self.detached_at = time.time()
+        mux.close()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.files.close()
+        if self.udp_sock:
+            udp_sock, self.udp_sock = self.udp_sock, None
+            self.udp_sender = None  # Stop new frames before the socket goes
+            udp_sock.close()
+
+    def wait_attached(self):
+        """Block while detached; returns False once the session should end"""
+        while self.active and not self.attached.wait(0.5):
+            if time.time() - self.detached_at > RESUME_GRACE:
+                print(f"[Server] Session {self.token[:8]} expired")
+                self.active = False
+        return self.active
 
 def safe_move(x, y):
     try:
@@ -81,146 +155,384 @@ def safe_key(key, action):
         print(f"[Server] Key {action} error for '{key}': {e}")
         return False
 
-def get_cursor_position():
-    """Get current cursor position"""
-    try:
-        point = POINT()
-        if GetCursorPos(ctypes.byref(point)):
-            return (point.x, point.y)
-    except Exception:
-        pass
-    return (0, 0)
-
 def capture_screen_and_mouse(conn):
     """Combined screen capture and mouse info sender"""
     with mss() as sct:
         monitor = sct.monitors[1]
+        encoder = conn.encoder
         frame_count = 0
         last_mouse_send = 0
+        last_view = None
+        view_since = 0  # First frame captured with the current view
+        udp_failing = False
         
-        while conn.active:
+        while conn.wait_attached():
             try:
                 current_time = time.time()
+                t = time.perf_counter()
                 
-                # Capture screen
-                img = sct.grab(monitor)
-                img_np = np.array(img)
-                img_bgr = cv2.cvtColor(img_np, cv2.COLOR_BGRA2BGR)
+                # Capture screen, or only the region the client is zoomed into
+                view = clamp_view(conn.view, monitor)
+                if view != last_view:
+                    last_view = view
+                    view_since = frame_count + 1
+                if view:
+                    x, y, w, h = view
+                    region = {'left': monitor['left'] + x, 'top': monitor['top'] + y, 'width': w, 'height': h}
+                else:
+                    region = monitor
+                img = sct.grab(region)
+                t = stats.lap('grab', t)
+
+                if conn.shm_requested and not conn.shm_writer:
+                    conn.shm_requested = False
+                    try:
+                        conn.shm_writer = ShmFrameWriter(monitor['width'], monitor['height'])
+                        conn.mux.send_text(CONTROL, f"SHM|{conn.shm_writer.name}")
+                        print(f"[Server Screen] Shared-memory frames in {conn.shm_writer.name}")
+                    except OSError as e:
+                        print(f"[Server Screen] Shared memory unavailable, staying on TCP: {e}")
+
+                if conn.shm_writer:
+                    # Same-machine viewer: convert straight into shared memory, no encode or socket
+                    mouse_x, mouse_y, mouse_visible, _ = read_cursor()
+                    conn.shm_writer.write(img, (monitor['width'], monitor['height']), view,
+                                          (mouse_x, mouse_y), mouse_visible, conn.remote_controlling,
+                                          current_time)
+                    stats.lap('convert', t)
+                    stats.add('frames_sent')
+                else:
+                    # After a resume, diff against the frame the client still holds
+                    base, conn.resume_base = conn.resume_base, None
+                    prev = encoder.frame_for(base) if base is not None and base >= view_since else None
+                    if prev is not None and prev is encoder.ring[(encoder.slot + 1) % len(encoder.ring)]:
+                        prev = prev.copy()  # Its ring slot is about to be reused
+
+                    frame_count += 1
+                    img_bgr = encoder.to_bgr(img, frame_count)
+                    t = stats.lap('convert', t)
                 
-                # Compress image
-                quality = 55 if conn.remote_controlling else 45
-                _, buffer = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                    # Compress image
+                    if view:
+                        quality = ZOOM_QUALITY
+                    else:
+                        quality = 55 if conn.remote_controlling else 45
+                    if prev is not None and prev.shape == img_bgr.shape:
+                        frame_fields = {'type': 'delta', 'base': base,
+                                        'tiles': encode_delta(prev, img_bgr, quality)}
+                        stats.add('delta_frames')
+                    else:
+                        frame_fields = {'type': 'key', 'screen': encoder.encode(img_bgr, quality)}
+                    t = stats.lap('encode', t)
                 
-                # Get mouse position
-                mouse_pos = get_cursor_position()
+                    # Get mouse position
+                    mouse_x, mouse_y, mouse_visible, _ = read_cursor()
                 
-                # Create combined data packet
-                packet_data = {
-                    'screen': buffer,
-                    'mouse_x': mouse_pos[0],
-                    'mouse_y': mouse_pos[1],
-                    'mouse_visible': True,  # Simplified - always visible for now
-                    'controlling': conn.remote_controlling,
-                    'screen_width': monitor['width'],
-                    'screen_height': monitor['height'],
-                    'timestamp': current_time
-                }
+                    # Create combined data packet
+                    packet_data = {
+                        **frame_fields,
+                        'seq': frame_count,
+                        'mouse_x': mouse_x,
+                        'mouse_y': mouse_y,
+                        'mouse_visible': mouse_visible,
+                        'controlling': conn.remote_controlling,
+                        'screen_width': monitor['width'],
+                        'screen_height': monitor['height'],
+                        'view': view,
+                        'timestamp': current_time
+                    }
                 
-                # Send data
-                data = pickle.dumps(packet_data, 0)
-                size = len(data)
+                    # Send data
+                    data = serialize(packet_data)
+                    is_key = frame_fields['type'] == 'key'
+                    if is_key:
+                        conn.last_keyframe = data
+                    t = stats.lap('serialize', t)
                 
-                if not conn.active:
-                    break
+                    if not conn.active:
+                        break
                     
-                conn.sock.sendall(struct.pack(">L", size) + data)
+                    udp_sender = conn.udp_sender  # detach() may clear it from the input thread
+                    if udp_sender:
+                        try:
+                            udp_sender.send_frame(data)
+                            stats.add('bytes_sent', len(data))
+                            udp_failing = False
+                        except OSError as e:
+                            if not conn.attached.is_set():
+                                continue  # Its socket was closed by a detach; wait for a resume
+                            # E.g. the client's port is refusing or the buffers are full;
+                            # this frame goes over TCP instead
+                            if not udp_failing:
+                                print(f"[Server Screen] UDP send failed, falling back to TCP: {e}")
+                            udp_failing = True
+                            stats.add('udp_send_errors')
+                            conn.mux.send(VIDEO, data)
+                    else:
+                        conn.mux.send(VIDEO, data)
+                    stats.lap('send', t)
+                    stats.add('frames_sent')
+
+                    if conn.recorder:
+                        conn.recorder.write(data, current_time, keyframe=is_key)
                 
                 # Frame rate control
                 frame_time = time.time() - current_time
                 target_fps = 45 if conn.remote_controlling else 25
                 sleep_time = max(0, (1.0 / target_fps) - frame_time)
                 if sleep_time > 0:
-                    time.sleep(sleep_time)
-                    
-                frame_count += 1
+                    # A keyframe request cuts the wait short
+                    conn.keyframe_event.wait(sleep_time)
+                    conn.keyframe_event.clear()
+                else:
+                    stats.add('frames_late')
                 
+            except ConnectionError:
+                continue  # Socket dropped mid-send; wait for a resume
             except Exception as e:
                 print(f"[Server Screen] Error: {e}")
                 break
                 
+    end_session(conn)
     print("[Server Screen] Thread exited cleanly")
 
-def handle_input(conn):
-    """Enhanced input handling"""
-    buffer = ""
-    conn.remote_controlling = False
-    last_activity = time.time()
-    
-    while conn.active:
+def end_session(conn):
+    """Release everything a session owns"""
+    conn.active = False
+    with sessions_lock:
+        sessions.pop(conn.token, None)
+        stats.set_gauge('sessions', len(sessions))
+    if conn.mux:
+        conn.detach(conn.mux)
+    if conn.recorder:
+        conn.recorder.close()
+    if conn.shm_writer:
+        conn.shm_writer.close()
+
+def stream_cursor(conn):
+    """Send cursor position, visibility and shape changes on the high-priority cursor channel"""
+    last_state = None
+    while conn.wait_attached():
         try:
-            data = conn.sock.recv(4096).decode('utf-8')
-            if not data:
-                print("[Server Input] Client disconnected")
-                break
+            x, y, visible, handle = read_cursor()
+            shape = cursor_shapes.shape_for(handle)
+            state = (x, y, visible, shape)
+            if state != last_state:
+                conn.mux.send(CURSOR, serialize(cursor_update(x, y, visible, shape, conn.cursor_shapes_sent)))
+                last_state = state
+            time.sleep(1.0 / CURSOR_HZ)
+        except ConnectionError:
+            last_state = None  # Resend the cursor after a resume
+        except Exception as e:
+            print(f"[Server Cursor] Error: {e}")
+            break
 
-            buffer += data
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                line = line.strip()
-                if not line:
-                    continue
+def handle_input_command(cmd, parts, line):
+    """Apply one command from the input channel"""
+    if cmd == 'MOVE' and len(parts) >= 3:
+        try:
+            x, y = int(parts[1]), int(parts[2])
+            safe_move(x, y)
+        except ValueError:
+            print(f"[Server Input] Invalid MOVE: {line}")
 
-                parts = line.split('|')
-                cmd = parts[0]
-                current_time = time.time()
-                
-                # Update activity tracking
-                if cmd in ['MOVE', 'CLICK', 'SCROLL', 'KEY']:
-                    last_activity = current_time
-                    conn.remote_controlling = True
+    elif cmd == 'CLICK' and len(parts) >= 3:
+        button = parts[1]
+        pressed = parts[2] == 'True'
+        safe_click(button, pressed)
 
-                if cmd == 'MOVE' and len(parts) >= 3:
-                    try:
-                        x, y = int(parts[1]), int(parts[2])
-                        safe_move(x, y)
-                    except ValueError:
-                        print(f"[Server Input] Invalid MOVE: {line}")
+    elif cmd == 'SCROLL' and len(parts) >= 3:
+        try:
+            dx, dy = int(parts[1]), int(parts[2])
+            safe_scroll(dx, dy)
+        except ValueError:
+            print(f"[Server Input] Invalid SCROLL: {line}")
 
-                elif cmd == 'CLICK' and len(parts) >= 3:
-                    button = parts[1]
-                    pressed = parts[2] == 'True'
-                    safe_click(button, pressed)
+    elif cmd == 'KEY' and len(parts) >= 3:
+        key = parts[1]
+        action = parts[2]
+        safe_key(key, action)
 
-                elif cmd == 'SCROLL' and len(parts) >= 3:
-                    try:
-                        dx, dy = int(parts[1]), int(parts[2])
-                        safe_scroll(dx, dy)
-                    except ValueError:
-                        print(f"[Server Input] Invalid SCROLL: {line}")
-
-                elif cmd == 'KEY' and len(parts) >= 3:
-                    key = parts[1]
-                    action = parts[2]
-                    safe_key(key, action)
-                    
-                elif cmd == 'PING':
-                    # Respond to ping
-                    try:
-                        conn.sock.sendall(b'PONG\n')
-                    except:
-                        break
+def handle_control_command(conn, cmd, parts, line):
+    """Apply one command from the control channel"""
+    if cmd == 'PING':
+        conn.mux.send_text(CONTROL, 'PONG')
+
+    elif cmd == 'STATS':
+        conn.mux.send_text(CONTROL, 'STATS|' + json.dumps(stats.snapshot()))
+
+    elif cmd == 'UDP' and len(parts) >= 3:
+        # Switch frames to UDP; input and control stay on TCP
+        try:
+            port, fec_group = int(parts[1]), int(parts[2])
+            conn.udp_sock = open_udp_socket()
+            conn.udp_sender = UdpFrameSender(conn.udp_sock, (conn.addr[0], port), fec_group=fec_group)
+            print(f"[Server Input] UDP frames to {conn.addr[0]}:{port} (FEC group {fec_group})")
+        except (ValueError, OSError) as e:
+            print(f"[Server Input] Invalid UDP request: {line} ({e})")
 
-            # Check for inactivity
-            if current_time - last_activity > 2.0:
-                conn.remote_controlling = False
+    elif cmd == 'SHM':
+        # A viewer on this machine maps frames directly instead of receiving them
+        if conn.addr[0] not in ('127.0.0.1', '::1'):
+            print(f"[Server Input] Ignoring SHM request from remote {conn.addr[0]}")
+        elif conn.recorder:
+            print("[Server Input] Shared-memory frames are disabled while recording")
+        elif conn.shm_writer:
+            conn.mux.send_text(CONTROL, f"SHM|{conn.shm_writer.name}")
+        else:
+            conn.shm_requested = True
+            conn.keyframe_event.set()
+
+    elif cmd == 'VIEW':
+        # VIEW|x|y|w|h zooms into a region of the host screen; a bare VIEW shows all of it
+        try:
+            conn.view = tuple(int(v) for v in parts[1:5]) if len(parts) >= 5 else None
+        except ValueError:
+            return
+        conn.keyframe_event.set()
+
+    elif cmd == 'KEYFRAME':
+        # The client dropped an incomplete UDP frame
+        stats.add('keyframe_requests')
+        conn.keyframe_event.set()
+
+    elif cmd == 'BYE':
+        # Deliberate disconnect: no resume expected
+        conn.active = False
+
+    elif cmd.startswith('FILE_'):
+        conn.files.handle_control(cmd, line.partition('|')[2])
+
+def handle_message(conn, channel, payload):
+    """Dispatch one message from the client"""
+    if channel == BULK:
+        conn.files.handle_bulk(payload)
+        return
+
+    line = payload.decode('utf-8').strip()
+    if not line:
+        return
+
+    parts = line.split('|')
+    cmd = parts[0]
+    current_time = time.time()
+
+    if channel == INPUT:
+        # Update activity tracking
+        conn.last_activity = current_time
+        stats.add('input_events')
+        conn.remote_controlling = True
+        handle_input_command(cmd, parts, line)
 
+    elif channel == CONTROL:
+        handle_control_command(conn, cmd, parts, line)
+
+    # Check for inactivity
+    if current_time - conn.last_activity > 2.0:
+        conn.remote_controlling = False
+
+def handle_input(conn, mux):
+    """Receive input and control messages until this socket drops or is replaced"""
+    while conn.active and conn.mux is mux:
+        try:
+            channel, payload = mux.recv()
+            handle_message(conn, channel, payload)
+
+        except ConnectionError:
+            print("[Server Input] Client disconnected")
+            break
         except Exception as e:
             print(f"[Server Input] Error: {e}")
             break
 
-    conn.active = False
     print("[Server Input] Thread exited cleanly")
 
+def open_session(sock, addr, mux):
+    """Read the client's HELLO or RESUME and bind the socket to a session"""
+    sock.settimeout(HANDSHAKE_TIMEOUT)
+    channel, payload = mux.recv()
+    sock.settimeout(None)
+
+    pending = (channel, payload)
+    parts = payload.decode('utf-8', 'replace').split('|') if channel == CONTROL else ['']
+    if parts[0] in ('HELLO', 'RESUME'):
+        pending = None
+
+    if parts[0] == 'RESUME' and len(parts) >= 3:
+        with sessions_lock:
+            conn = sessions.get(parts[1])
+        if conn is not None and conn.active:
+            conn.attach(sock, addr, mux)
+            try:
+                client_seq = int(parts[2])
+            except ValueError:
+                client_seq = None
+
+            if conn.encoder.frame_for(client_seq) is not None:
+                # The client holds a frame we still have: send only what changed since
+                conn.resume_base = client_seq
+                conn.keyframe_event.set()
+            elif conn.last_keyframe is not None:
+                # Repaint right away from the cached frame
+                mux.send(VIDEO, conn.last_keyframe)
+            stats.add('sessions_resumed')
+            print(f"🔁 Session {conn.token[:8]} resumed by {addr}")
+            return conn, True, pending
+
+    conn = Connection(addr)
+    conn.attach(sock, addr, mux)
+    with sessions_lock:
+        sessions[conn.token] = conn
+        stats.set_gauge('sessions', len(sessions))
+    return conn, False, pending
+
+def handle_connection(client_sock, addr):
+    """Serve one viewer socket; sessions keep their capture threads across reconnects"""
+    mux = MuxConnection(client_sock, stats=stats)
+    with connections_lock:
+        connections.add(mux)
+        stats.set_gauge('active_connections', len(connections))
+    stats.add('connections')
+
+    try:
+        try:
+            conn, resumed, pending = open_session(client_sock, addr, mux)
+        except (ConnectionError, OSError):
+            # Scanners connect and hang up without a handshake
+            mux.close()
+            client_sock.close()
+            return
+
+        mux.send_text(CONTROL, f"SESSION|{conn.token}|{int(resumed)}")
+        if not resumed:
+            if RECORD_DIR:
+                conn.recorder = SessionRecorder(recording_path(RECORD_DIR, addr[0]))
+
+            # Start service threads
+            threading.Thread(target=capture_screen_and_mouse, args=(conn,), daemon=True).start()
+            threading.Thread(target=stream_cursor, args=(conn,), daemon=True).start()
+        if pending:
+            handle_message(conn, *pending)
+
+        # Handle input in this connection's thread
+        handle_input(conn, mux)
+
+        conn.detach(mux)
+        if conn.active:
+            print(f"⏸ Session {conn.token[:8]} from {addr} detached, resumable for {RESUME_GRACE:.0f}s")
+        else:
+            print(f"🔚 Connection with {addr} closed")
+
+    except Exception as e:
+        print(f"[Server Conn] Error: {e}")
+        mux.close()
+        client_sock.close()
+
+    finally:
+        with connections_lock:
+            connections.discard(mux)
+            stats.set_gauge('active_connections', len(connections))
+
 def start_server():
     """Start the enhanced server"""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -231,23 +543,17 @@ def start_server():
         print(f"✅ Enhanced Server listening on {HOST}:{PORT}...")
         print("Features: Mouse Sync, Dynamic Quality, Auto Cursor Management")
 
+        if STATS_PORT:
+            stats.serve(STATS_PORT)
+        if STATS_LOG:
+            stats.start_json_log(STATS_LOG)
+
         while True:
             try:
                 client_sock, addr = s.accept()
                 client_sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
                 print(f"🔗 Connected by {addr}")
-                conn = Connection(client_sock, addr)
-
-                # Start service threads
-                screen_thread = threading.Thread(target=capture_screen_and_mouse, args=(conn,), daemon=True)
-                screen_thread.start()
-
-                # Handle input in main connection thread
-                handle_input(conn)
-
-                conn.active = False
-                client_sock.close()
-                print(f"🔚 Connection with {addr} closed")
+                threading.Thread(target=handle_connection, args=(client_sock, addr), daemon=True).start()
 
             except Exception as e:
                 print(f"[Server Main] Error: {e}")
@@ -0,0 +1,237 @@
+# loadgen.py — HEADLESS LOAD-GENERATOR CLIENT
+# Opens many concurrent viewer sessions against a host for soak and scale testing
+#
+# Usage:
+#   python loadgen.py 192.168.1.20 --sessions 20 --duration 3600 --mode decode
+#   python loadgen.py 127.0.0.1 --script input.txt --json results.json
+#
+# Input scripts hold one "<delay seconds> <command>" per line, e.g. "0.05 MOVE|640|360",
+# using the same commands the GUI client sends. The script loops for the whole run.
+
+import argparse
+import json
+import pickle
+import socket
+import threading
+import time
+
+from protocol import MuxConnection, VIDEO, INPUT, CONTROL
+from stats import PipelineStats
+
+PORT = 65432
+STALL_THRESHOLD = 0.5  # Seconds between frames that count as a stall
+
+def load_script(path):
+    """Parse an input script into (delay, command) pairs"""
+    steps = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            delay, command = line.split(None, 1)
+            steps.append((float(delay), command))
+    return steps
+
+class LoadSession:
+    """One headless viewer speaking the full client protocol"""
+
+    def __init__(self, index, host, port, mode, script, ping_interval):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.script = script
+        self.ping_interval = ping_interval
+        self.stats = PipelineStats(f"session-{index}")
+        self.sock = None
+        self.mux = None
+        self.running = False
+        self.error = None
+        self.last_ping_time = 0
+        self.last_frame_time = 0
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(5)
+        self.sock.connect((self.host, self.port))
+        self.sock.settimeout(None)
+        self.mux = MuxConnection(self.sock, stats=self.stats)
+        self.mux.send_text(CONTROL, 'HELLO')
+        self.running = True
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+        threading.Thread(target=self.ping_loop, daemon=True).start()
+        if self.script:
+            threading.Thread(target=self.input_loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        if self.mux:
+            try:
+                # Tell the host not to hold the session for a resume
+                self.mux.send_text(CONTROL, 'BYE')
+                self.mux.flush(0.5)
+            except:
+                pass
+            self.mux.close()
+        if self.sock:
+            try:
+                self.sock.close()
+            except:
+                pass
+
+    def receive_loop(self):
+        if self.mode == 'decode':
+            import cv2
+
+        while self.running:
+            try:
+                channel, frame_data = self.mux.recv()
+                now = time.time()
+                if channel == CONTROL:
+                    if frame_data == b'PONG':
+                        self.stats.record('rtt', now - self.last_ping_time)
+                    continue
+                if channel != VIDEO:
+                    continue
+
+                if self.last_frame_time:
+                    gap = now - self.last_frame_time
+                    self.stats.record('frame_gap', gap)
+                    if gap > STALL_THRESHOLD:
+                        self.stats.add('stalls')
+                        self.stats.add('stall_ms', int(gap * 1000))
+                self.last_frame_time = now
+
+                if self.mode == 'count':
+                    continue
+
+                t = time.perf_counter()
+                packet_info = pickle.loads(frame_data)
+                # Only meaningful when host and load generator share a clock
+                self.stats.record('frame_age', max(0.0, now - packet_info['timestamp']))
+                if self.mode == 'decode':
+                    frame = cv2.imdecode(packet_info['screen'], cv2.IMREAD_COLOR)
+                    if frame is None:
+                        self.stats.add('frames_dropped')
+                self.stats.lap('decode', t)
+
+            except Exception as e:
+                if self.running:
+                    self.error = str(e)
+                    print(f"[Session {self.index}] Receive error: {e}")
+                break
+
+        self.running = False
+
+    def ping_loop(self):
+        while self.running:
+            try:
+                self.last_ping_time = time.time()
+                self.mux.send_text(CONTROL, 'PING')
+                time.sleep(self.ping_interval)
+            except:
+                break
+
+    def input_loop(self):
+        while self.running:
+            for delay, command in self.script:
+                if not self.running:
+                    return
+                time.sleep(delay)
+                try:
+                    self.mux.send_text(INPUT, command)
+                    self.stats.add('input_events')
+                except:
+                    return
+
+    def report(self):
+        """Per-session summary dict"""
+        snapshot = self.stats.snapshot()
+        counters = snapshot['counters']
+        stages = snapshot['stages']
+        uptime = max(snapshot['uptime_s'], 1e-9)
+        return {
+            'session': self.index,
+            'alive': self.running,
+            'error': self.error,
+            'fps': round(counters.get('frames_received', 0) / uptime, 1),
+            'mbps': round(counters.get('bytes_received', 0) * 8 / 1e6 / uptime, 2),
+            'frames': counters.get('frames_received', 0),
+            'stalls': counters.get('stalls', 0),
+            'stall_ms': counters.get('stall_ms', 0),
+            'rtt_p95_ms': stages.get('rtt', {}).get('p95_ms', 0.0),
+            'gap_p95_ms': stages.get('frame_gap', {}).get('p95_ms', 0.0),
+            'gap_max_ms': stages.get('frame_gap', {}).get('max_ms', 0.0),
+            'age_p95_ms': stages.get('frame_age', {}).get('p95_ms', 0.0),
+            'stats': snapshot,
+        }
+
+def print_report(sessions):
+    print(f"{'#':>3} {'alive':>5} {'fps':>6} {'Mbps':>7} {'frames':>7} {'stalls':>6} "
+          f"{'rtt p95':>8} {'gap p95':>8} {'gap max':>8} {'age p95':>8}")
+    total_fps = total_mbps = 0.0
+    for session in sessions:
+        r = session.report()
+        total_fps += r['fps']
+        total_mbps += r['mbps']
+        print(f"{r['session']:>3} {str(r['alive']):>5} {r['fps']:>6.1f} {r['mbps']:>7.2f} {r['frames']:>7} "
+              f"{r['stalls']:>6} {r['rtt_p95_ms']:>8.1f} {r['gap_p95_ms']:>8.1f} {r['gap_max_ms']:>8.1f} "
+              f"{r['age_p95_ms']:>8.1f}")
+    alive = sum(1 for s in sessions if s.running)
+    print(f"Total: {alive}/{len(sessions)} alive | {total_fps:.1f} FPS | {total_mbps:.2f} Mbps")
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless load generator for the remote desktop host")
+    parser.add_argument("host")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run, 0 = until Ctrl+C")
+    parser.add_argument("--mode", choices=["count", "parse", "decode"], default="parse",
+                        help="count frames only, unpickle them, or fully decode the JPEG")
+    parser.add_argument("--script", help="Input script replayed by every session")
+    parser.add_argument("--ping", type=float, default=1.0, help="Seconds between PINGs")
+    parser.add_argument("--report", type=float, default=10.0, help="Seconds between progress reports")
+    parser.add_argument("--ramp", type=float, default=0.1, help="Seconds between session starts")
+    parser.add_argument("--json", help="Write the final per-session report to this file")
+    args = parser.parse_args()
+
+    script = load_script(args.script) if args.script else None
+    sessions = []
+    for i in range(args.sessions):
+        session = LoadSession(i, args.host, args.port, args.mode, script, args.ping)
+        try:
+            session.start()
+        except Exception as e:
+            session.error = str(e)
+            print(f"[Session {i}] Connect failed: {e}")
+        sessions.append(session)
+        time.sleep(args.ramp)
+
+    print(f"🚀 {sum(1 for s in sessions if s.running)}/{args.sessions} sessions connected to {args.host}:{args.port}")
+    started = time.time()
+    last_report = started
+    try:
+        while args.duration <= 0 or time.time() - started < args.duration:
+            time.sleep(0.5)
+            if time.time() - last_report >= args.report:
+                last_report = time.time()
+                print_report(sessions)
+            if not any(s.running for s in sessions):
+                print("All sessions ended")
+                break
+    except KeyboardInterrupt:
+        pass
+
+    print_report(sessions)
+    for session in sessions:
+        session.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([s.report() for s in sessions], f, indent=2)
+        print(f"📄 Report written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# protocol.py — MULTIPLEXED WIRE PROTOCOL
+# One TCP connection carries typed channels in both directions:
+#   VIDEO   : pickled frame packets (host -> client)
+#   CURSOR  : pickled cursor updates (host -> client)
+#   INPUT   : '|'-delimited input commands such as MOVE|x|y (client -> host)
+#   CONTROL : '|'-delimited control commands: HELLO/RESUME, PING/PONG, STATS, UDP, KEYFRAME, ...
+#   BULK    : large transfers that must never hold up interactive traffic
+#
+# Chunk: [channel:u8][flags:u8][length:u32][payload]
+# Messages are cut into CHUNK_SIZE chunks. A single writer thread always sends the next
+# chunk from the highest-priority channel with data waiting, so a PONG or a keypress
+# goes out between two chunks of a megabyte-sized frame instead of behind it.
+# Video and bulk share what is left: while both are waiting, one bulk chunk goes out
+# per BULK_SHARE video chunks, and bulk can additionally be capped to a byte rate.
+# The writer's priorities only hold if the kernel does not queue megabytes ahead of
+# them, so a socket that carries bulk data should go through limit_unsent().
+
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+VIDEO, CURSOR, INPUT, CONTROL, BULK = 1, 2, 3, 4, 5
+CHANNEL_NAMES = {VIDEO: 'video', CURSOR: 'cursor', INPUT: 'input', CONTROL: 'control', BULK: 'bulk'}
+PRIORITY = (INPUT, CONTROL, CURSOR, VIDEO, BULK)
+
+CHUNK_HEADER = struct.Struct(">BBI")
+FLAG_END = 0x01
+CHUNK_SIZE = 16384
+RECV_SIZE = 65536
+BULK_SHARE = 4
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024  # Largest reassembled message accepted from a peer
+# Per-channel message limits; a peer's half-received messages never hold more than
+# MAX_MESSAGE_SIZE in total
+MESSAGE_LIMITS = {VIDEO: MAX_MESSAGE_SIZE, CURSOR: 1024 * 1024, INPUT: 4096,
+                  CONTROL: 256 * 1024, BULK: MAX_MESSAGE_SIZE}
+
+UNSENT_LOWAT = 2 * CHUNK_SIZE  # Unsent bytes the kernel may queue on a bulk-carrying socket
+SEND_BUFFER_FALLBACK = 64 * 1024  # Send buffer where TCP_NOTSENT_LOWAT is unavailable
+
+def limit_unsent(sock):
+    """Keep the kernel from buffering bulk data far ahead of the next interactive chunk
+
+    A sendfile() into an autotuned send buffer queues megabytes, and an input chunk sent
+    after it waits for all of them. TCP_NOTSENT_LOWAT bounds only the unsent part, so
+    throughput is unaffected; without it, fall back to a small send buffer.
+    """
+    lowat = getattr(socket, 'TCP_NOTSENT_LOWAT', None)
+    if lowat is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, lowat, UNSENT_LOWAT)
+            return
+        except OSError:
+            pass
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_FALLBACK)
+
+def send_buffers(sock, buffers):
+    """Send several buffers back to back without concatenating them"""
+    if not hasattr(sock, 'sendmsg'):
+        # Windows sockets have no sendmsg. With TCP_NODELAY every send is its own segment,
+        # so a chunk-sized message is joined into one send; only larger ones skip the copy
+        if sum(len(buffer) for buffer in buffers) <= CHUNK_HEADER.size + CHUNK_SIZE:
+            sock.sendall(b''.join(buffers))
+            return
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+
+    buffers = [memoryview(b) for b in buffers]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if buffers and sent:
+            buffers[0] = buffers[0][sent:]
+
+class OutgoingMessage:
+    """A queued message sent one chunk at a time"""
+
+    def __init__(self, payload):
+        self.view = memoryview(payload).cast('B')
+        self.offset = 0
+        self.started = False
+
+    def write_chunk(self, sock, channel, max_size):
+        """Send the next chunk; returns (bytes sent, whether it was the last chunk)"""
+        chunk = self.view[self.offset:self.offset + max_size]
+        self.offset += len(chunk)
+        last = self.offset >= len(self.view)
+        send_buffers(sock, [CHUNK_HEADER.pack(channel, FLAG_END if last else 0, len(chunk)), chunk])
+        return CHUNK_HEADER.size + len(chunk), last
+
+    def close(self):
+        """Release resources of a message that will never be sent"""
+
+class MuxConnection:
+    """Prioritized, chunk-interleaved channels over one stream socket"""
+
+    def __init__(self, sock, stats=None, latest_only=(VIDEO,), chunk_size=CHUNK_SIZE, bulk_rate=None):
+        self.sock = sock
+        self.stats = stats
+        self.latest_only = latest_only  # Channels where a newer message replaces a waiting one
+        self.chunk_size = min(chunk_size, CHUNK_SIZE)  # Peers reject anything larger
+        self.queues = {channel: deque() for channel in PRIORITY}
+        self.cond = threading.Condition()
+        self.closed = False
+        self.error = None
+
+        self.bulk_rate = bulk_rate  # Bytes per second cap for the bulk channel, None = uncapped
+        self.bulk_tokens = 0.0
+        self.bulk_refill = time.perf_counter()
+        self.video_streak = 0
+
+        self.rx = bytearray()
+        self.partial = {}
+        self.partial_started = {}
+        self.partial_bytes = 0
+
+        threading.Thread(target=self.writer_loop, daemon=True).start()
+
+    def send(self, channel, payload):
+        """Queue a message (bytes-like or OutgoingMessage) on a channel"""
+        message = payload if isinstance(payload, OutgoingMessage) else OutgoingMessage(payload)
+        with self.cond:
+            if self.closed:
+                raise ConnectionError(self.error or "Connection closed")
+            queue = self.queues[channel]
+            if channel in self.latest_only:
+                # Anything not yet on the wire is stale once a newer message arrives
+                while queue and not queue[-1].started:
+                    queue.pop()
+                    if self.stats:
+                        self.stats.add('frames_dropped')
+            queue.append(message)
+            if self.stats:
+                self.stats.set_gauge(f'{CHANNEL_NAMES[channel]}_queue', len(queue))
+            self.cond.notify()
+
+    def send_text(self, channel, text):
+        self.send(channel, text.encode('utf-8'))
+
+    def pending(self, channel):
+        """Messages queued on a channel, including one being sent"""
+        with self.cond:
+            return len(self.queues[channel])
+
+    def flush(self, timeout=1.0):
+        """Wait until everything queued has been written; returns False on timeout"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.closed or not any(self.queues.values()), timeout)
+
+    def bulk_wait(self):
+        """Seconds until the bulk rate cap allows another chunk"""
+        if not self.bulk_rate:
+            return 0
+        now = time.perf_counter()
+        burst = max(self.chunk_size, self.bulk_rate * 0.1)
+        self.bulk_tokens = min(burst, self.bulk_tokens + (now - self.bulk_refill) * self.bulk_rate)
+        self.bulk_refill = now
+        if self.bulk_tokens >= self.chunk_size:
+            return 0
+        return (self.chunk_size - self.bulk_tokens) / self.bulk_rate
+
+    def next_channel(self):
+        """Pick the channel for the next chunk with the lock held; returns (channel, wait)"""
+        for channel in PRIORITY[:PRIORITY.index(VIDEO)]:
+            if self.queues[channel]:
+                return channel, None
+
+        video = bool(self.queues[VIDEO])
+        wait = self.bulk_wait() if self.queues[BULK] else None
+        if wait == 0 and (not video or self.video_streak >= BULK_SHARE):
+            self.video_streak = 0
+            return BULK, None
+        if video:
+            self.video_streak += 1
+            return VIDEO, None
+        return None, wait
+
+    def writer_loop(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.closed:
+                        return
+                    channel, wait = self.next_channel()
+                    if channel is not None:
+                        break
+                    self.cond.wait(wait)
+                message = self.queues[channel][0]
+                message.started = True
+
+            try:
+                t = time.perf_counter()
+                sent, last = message.write_chunk(self.sock, channel, self.chunk_size)
+                if self.stats:
+                    self.stats.lap('socket_write', t)
+                    self.stats.add('bytes_sent', sent)
+                if channel == BULK and self.bulk_rate:
+                    with self.cond:
+                        self.bulk_tokens -= sent
+            except Exception as e:
+                self.close(f"Send failed: {e}")
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)  # Wake the reader too
+                except OSError:
+                    pass
+                return
+
+            if last:
+                with self.cond:
+                    if self.closed:
+                        return  # close() already released the queues
+                    self.queues[channel].popleft()
+                    self.cond.notify_all()
+                    if self.stats:
+                        self.stats.set_gauge(f'{CHANNEL_NAMES[channel]}_queue', len(self.queues[channel]))
+
+    def fill(self, size):
+        while len(self.rx) < size:
+            packet = self.sock.recv(RECV_SIZE)
+            if not packet:
+                raise ConnectionError("Peer disconnected")
+            self.rx += packet
+
+    def recv(self):
+        """Block until a complete message arrives; returns (channel, bytes)"""
+        while True:
+            self.fill(CHUNK_HEADER.size)
+            channel, flags, length = CHUNK_HEADER.unpack_from(self.rx)
+            if channel not in CHANNEL_NAMES:
+                self.protocol_error(f"unknown channel {channel}")
+            if length > CHUNK_SIZE:
+                self.protocol_error(f"{length}-byte chunk exceeds {CHUNK_SIZE}")
+            end = CHUNK_HEADER.size + length
+            self.fill(end)
+            chunk = self.rx[CHUNK_HEADER.size:end]
+            del self.rx[:end]
+            if self.stats:
+                self.stats.add('bytes_received', end)
+
+            parts = self.partial.get(channel)
+            if parts is None and not flags & FLAG_END:
+                parts = self.partial[channel] = bytearray()
+                self.partial_started[channel] = time.perf_counter()
+            held = len(parts) if parts is not None else 0
+            if held + len(chunk) > MESSAGE_LIMITS[channel]:
+                self.protocol_error(f"{CHANNEL_NAMES[channel]} message exceeds {MESSAGE_LIMITS[channel]} bytes")
+            if parts is not None:
+                if self.partial_bytes + len(chunk) > MAX_MESSAGE_SIZE:
+                    self.protocol_error(f"partial messages exceed {MAX_MESSAGE_SIZE} bytes")
+                parts += chunk
+                self.partial_bytes += len(chunk)
+            if not flags & FLAG_END:
+                continue
+
+            if parts is not None:
+                del self.partial[channel]
+                self.partial_bytes -= len(parts)
+                started = self.partial_started.pop(channel)
+                message = bytes(parts)
+            else:
+                started = None
+                message = bytes(chunk)
+            if self.stats and channel == VIDEO:
+                self.stats.add('frames_received')
+                if started is not None:
+                    self.stats.lap('recv', started)
+            return channel, message
+
+    def protocol_error(self, reason):
+        """Drop a peer that breaks framing limits instead of buffering without bound"""
+        self.close(f"Protocol error: {reason}")
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        raise ConnectionError(f"Protocol error: {reason}")
+
+    def close(self, reason=None):
+        """Stop the writer and release unsent messages; the caller still owns and closes the socket"""
+        with self.cond:
+            if not self.closed:
+                self.closed = True
+                self.error = reason
+            pending = [message for queue in self.queues.values() for message in queue]
+            for queue in self.queues.values():
+                queue.clear()
+            self.cond.notify_all()
+        for message in pending:
+            message.close()
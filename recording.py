@@ -0,0 +1,246 @@
+# recording.py — SESSION RECORDING AND OFFLINE REPLAY
+# Tees the already-encoded stream into an indexed, seekable file without re-encoding
+#
+# File layout:
+#   header   : MAGIC (8 bytes)
+#   records  : [length:u32][flags:u8][timestamp:f64][payload ...] (append-only)
+#   index    : INDEX_MAGIC, count:u32, count x [timestamp:f64][offset:u64]
+#   trailer  : [index_offset:u64] END_MAGIC
+#
+# The index and trailer are written on close. A file left behind by a crash has
+# no trailer; the reader then rebuilds the keyframe index by scanning the records.
+
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'LSSREC1\x00'
+INDEX_MAGIC = b'LSSIDX1\x00'
+END_MAGIC = b'LSSEND1\x00'
+
+RECORD_HEADER = struct.Struct(">IBd")
+INDEX_ENTRY = struct.Struct(">dQ")
+INDEX_COUNT = struct.Struct(">I")
+TRAILER = struct.Struct(">Q8s")
+
+FLAG_KEYFRAME = 0x01
+
+class SessionRecorder:
+    """Append-only frame log with a keyframe index"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.keyframes = []
+        self.frame_count = 0
+        self.closed = False
+
+    def write(self, payload, timestamp=None, keyframe=True):
+        """Append one encoded frame exactly as it went over the wire"""
+        if timestamp is None:
+            timestamp = time.time()
+        flags = FLAG_KEYFRAME if keyframe else 0
+        with self.lock:
+            if self.closed:
+                return
+            if keyframe:
+                self.keyframes.append((timestamp, self.offset))
+            self.file.write(RECORD_HEADER.pack(len(payload), flags, timestamp))
+            self.file.write(payload)
+            self.offset += RECORD_HEADER.size + len(payload)
+            self.frame_count += 1
+
+    def close(self):
+        """Write the keyframe index and trailer"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            index_offset = self.offset
+            self.file.write(INDEX_MAGIC)
+            self.file.write(INDEX_COUNT.pack(len(self.keyframes)))
+            for timestamp, offset in self.keyframes:
+                self.file.write(INDEX_ENTRY.pack(timestamp, offset))
+            self.file.write(TRAILER.pack(index_offset, END_MAGIC))
+            self.file.close()
+        print(f"[Recorder] Saved {self.frame_count} frames to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SessionReader:
+    """Memory-mapped reader for recording files"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a session recording: {path}")
+
+        self.end = len(self.mm)
+        self.keyframes = []
+        if not self.load_index():
+            self.rebuild_index()
+        self.keyframe_times = [t for t, _ in self.keyframes]
+
+    def load_index(self):
+        """Read the index written on close, if the file has one"""
+        if self.end < len(MAGIC) + TRAILER.size:
+            return False
+        index_offset, end_magic = TRAILER.unpack_from(self.mm, self.end - TRAILER.size)
+        if end_magic != END_MAGIC:
+            return False
+        if self.mm[index_offset:index_offset + len(INDEX_MAGIC)] != INDEX_MAGIC:
+            return False
+
+        pos = index_offset + len(INDEX_MAGIC)
+        count = INDEX_COUNT.unpack_from(self.mm, pos)[0]
+        pos += INDEX_COUNT.size
+        self.keyframes = [INDEX_ENTRY.unpack_from(self.mm, pos + i * INDEX_ENTRY.size)
+                          for i in range(count)]
+        self.end = index_offset
+        return True
+
+    def rebuild_index(self):
+        """Scan the records of an unterminated file"""
+        print(f"[Reader] No index in {self.path}, scanning records")
+        pos = len(MAGIC)
+        while pos + RECORD_HEADER.size <= self.end:
+            length, flags, timestamp = RECORD_HEADER.unpack_from(self.mm, pos)
+            if pos + RECORD_HEADER.size + length > self.end:
+                break  # Truncated last record
+            if flags & FLAG_KEYFRAME:
+                self.keyframes.append((timestamp, pos))
+            pos += RECORD_HEADER.size + length
+        self.end = pos
+
+    def frames(self, offset=None):
+        """Yield (timestamp, keyframe, payload) starting at a record offset"""
+        pos = len(MAGIC) if offset is None else offset
+        view = memoryview(self.mm)
+        try:
+            while pos + RECORD_HEADER.size <= self.end:
+                length, flags, timestamp = RECORD_HEADER.unpack_from(self.mm, pos)
+                start = pos + RECORD_HEADER.size
+                yield timestamp, bool(flags & FLAG_KEYFRAME), view[start:start + length]
+                pos = start + length
+        finally:
+            view.release()
+
+    def seek(self, timestamp):
+        """Offset of the last keyframe at or before timestamp"""
+        if not self.keyframes:
+            return len(MAGIC)
+        i = bisect.bisect_right(self.keyframe_times, timestamp) - 1
+        return self.keyframes[max(i, 0)][1]
+
+    def start_time(self):
+        """Timestamp of the first recorded frame"""
+        for timestamp, _, payload in self.frames():
+            payload.release()
+            return timestamp
+        return 0.0
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def replay(path, on_frame, speed=1.0, start=0.0, stop_event=None):
+    """Feed a recording to on_frame(payload) at speed x realtime, 0 = as fast as possible"""
+    count = 0
+    with SessionReader(path) as reader:
+        first = reader.start_time()
+        offset = reader.seek(first + start)
+        wall_start = None
+        rec_start = None
+
+        for timestamp, _, payload in reader.frames(offset):
+            if stop_event is not None and stop_event.is_set():
+                payload.release()
+                break
+
+            if speed > 0:
+                if wall_start is None:
+                    wall_start, rec_start = time.time(), timestamp
+                delay = (timestamp - rec_start) / speed - (time.time() - wall_start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            try:
+                on_frame(payload)
+            finally:
+                payload.release()
+            count += 1
+    return count
+
+def recording_path(directory, label):
+    """Timestamped recording file name inside directory"""
+    os.makedirs(directory, exist_ok=True)
+    safe_label = "".join(c if c.isalnum() else "_" for c in str(label))
+    return os.path.join(directory, f"session_{safe_label}_{time.strftime('%Y%m%d_%H%M%S')}.lssrec")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay session recordings headlessly")
+    parser.add_argument("command", choices=["info", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 = realtime, 0 = as fast as possible")
+    parser.add_argument("--start", type=float, default=0.0, help="Seconds from the start of the recording")
+    parser.add_argument("--decode", action="store_true", help="Decode every JPEG frame")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        with SessionReader(args.path) as reader:
+            frames = 0
+            total_bytes = 0
+            first = last = None
+            for timestamp, _, payload in reader.frames():
+                frames += 1
+                total_bytes += len(payload)
+                payload.release()
+                first = timestamp if first is None else first
+                last = timestamp
+            duration = (last - first) if frames else 0.0
+            print(f"📼 {args.path}")
+            print(f"Frames: {frames} | Keyframes: {len(reader.keyframes)} | Duration: {duration:.1f}s")
+            print(f"Payload: {total_bytes / 1e6:.1f} MB | Avg frame: {total_bytes / max(frames, 1) / 1e3:.1f} KB")
+        return
+
+    if args.decode:
+        import pickle
+        import cv2
+
+        def decoder(payload):
+            packet_info = pickle.loads(payload)
+            if packet_info.get('type', 'key') == 'delta':
+                for _, _, buffer in packet_info['tiles']:
+                    cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            else:
+                cv2.imdecode(packet_info['screen'], cv2.IMREAD_COLOR)
+    else:
+        decoder = None
+
+    started = time.time()
+    count = replay(args.path, decoder or (lambda payload: None), speed=args.speed, start=args.start)
+    elapsed = time.time() - started
+    print(f"▶ Replayed {count} frames in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.1f} FPS)")
+
+if __name__ == "__main__":
+    main()
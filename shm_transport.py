@@ -0,0 +1,208 @@
+# shm_transport.py — SHARED-MEMORY FRAME TRANSPORT FOR SAME-MACHINE VIEWERS
+# A viewer running on the host machine maps the host's frames directly instead of
+# receiving JPEG packets over loopback TCP: the host converts each grab straight into a
+# slot of a shared-memory ring and the viewer scales the raw BGR pixels in place. No
+# encode, no pickle, no socket, and full resolution at any quality.
+#
+# Segment: [magic:8s][slots:u32][slot_size:u32][latest seq:u64], padded to SLOT_DATA,
+# then `slots` slots of
+#   [seq:u64][width:u32][height:u32][screen w,h:u32][view x,y,w,h:i32][mouse x,y:i32]
+#   [visible:u8][controlling:u8][timestamp:f64] ... pixels at SLOT_DATA
+# A slot's seq is 0 while it is being written. Readers check it again after scaling the
+# pixels and drop the frame if the writer lapped them in the meantime.
+#
+# Negotiated on the control channel: a loopback client sends SHM, the host replies
+# SHM|<segment name> and from then on publishes frames here instead of on VIDEO.
+#
+# Loopback self-test:
+#   python shm_transport.py --width 3840 --height 2160 --frames 300
+
+import argparse
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+MAGIC = b'LSSSHM1\x00'
+SEGMENT_HEADER = struct.Struct("<8sIIQ")
+SLOT_HEADER = struct.Struct("<QIIII4i2iBBxxxxxxd")
+SLOT_DATA = 128  # Pixel data offset in each slot; also the segment header size
+LATEST_OFFSET = 16
+SEQ = struct.Struct("<Q")
+SHM_SLOTS = 3
+POLL_INTERVAL = 0.002
+
+def open_segment(name):
+    """Attach to an existing segment without letting this process's exit remove it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument; on POSIX the resource tracker may then
+        # unlink the segment when this process exits, which only matters to the host
+        # if the viewer outlives it
+        return shared_memory.SharedMemory(name=name)
+
+class ShmFrameWriter:
+    """Host side: publishes grabs into a ring of raw BGR frame slots"""
+
+    def __init__(self, width, height, slots=SHM_SLOTS):
+        self.slots = slots
+        self.slot_size = SLOT_DATA + width * height * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=SLOT_DATA + slots * self.slot_size)
+        self.seq = 0
+        SEGMENT_HEADER.pack_into(self.shm.buf, 0, MAGIC, slots, self.slot_size, 0)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, img, screen_size, view, mouse, visible, controlling, timestamp):
+        """Convert an mss grab straight into the next slot and publish it; returns its seq"""
+        bgra = np.frombuffer(img.raw, dtype=np.uint8).reshape(img.height, img.width, 4)
+        h, w = bgra.shape[:2]
+        if SLOT_DATA + w * h * 3 > self.slot_size:
+            raise ValueError(f"{w}x{h} frame does not fit a shared-memory slot")
+
+        self.seq += 1
+        offset = SLOT_DATA + (self.seq % self.slots) * self.slot_size
+        buf = self.shm.buf
+        SEQ.pack_into(buf, offset, 0)
+        pixels = np.ndarray((h, w, 3), dtype=np.uint8, buffer=buf, offset=offset + SLOT_DATA)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=pixels)
+        del pixels
+        SLOT_HEADER.pack_into(buf, offset, self.seq, w, h, screen_size[0], screen_size[1],
+                              *(view or (0, 0, 0, 0)), mouse[0], mouse[1], visible, controlling, timestamp)
+        SEQ.pack_into(buf, LATEST_OFFSET, self.seq)
+        return self.seq
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+class ShmFrameReader:
+    """Viewer side: waits for new frames and exposes their pixels without copying"""
+
+    def __init__(self, name):
+        self.shm = open_segment(name)
+        magic, self.slots, self.slot_size, _ = SEGMENT_HEADER.unpack_from(self.shm.buf)
+        if magic != MAGIC:
+            self.shm.close()
+            raise ValueError(f"{name} is not a frame segment")
+        self.last_seq = 0
+        self.frames_skipped = 0
+
+    def slot_offset(self, seq):
+        return SLOT_DATA + (seq % self.slots) * self.slot_size
+
+    def read(self, timeout=None):
+        """Wait for a frame newer than the last one; returns (seq, info, pixels) or None on timeout
+
+        pixels is a view into shared memory: scale or copy it, then confirm with
+        still_valid(seq) before trusting the result.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        buf = self.shm.buf
+        while True:
+            seq = SEQ.unpack_from(buf, LATEST_OFFSET)[0]
+            if seq != self.last_seq:
+                offset = self.slot_offset(seq)
+                fields = SLOT_HEADER.unpack_from(buf, offset)
+                if fields[0] == seq:
+                    break
+                continue  # Lapped while looking; take the newer frame
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+        if self.last_seq and seq > self.last_seq + 1:
+            self.frames_skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        _, w, h, screen_w, screen_h, vx, vy, vw, vh, mouse_x, mouse_y, visible, controlling, timestamp = fields
+        info = {
+            'mouse_x': mouse_x,
+            'mouse_y': mouse_y,
+            'mouse_visible': bool(visible),
+            'controlling': bool(controlling),
+            'screen_width': screen_w,
+            'screen_height': screen_h,
+            'view': (vx, vy, vw, vh) if vw else None,
+            'timestamp': timestamp,
+        }
+        pixels = np.ndarray((h, w, 3), dtype=np.uint8, buffer=buf, offset=offset + SLOT_DATA)
+        return seq, info, pixels
+
+    def still_valid(self, seq):
+        """True if the slot read as seq has not been rewritten since"""
+        return SEQ.unpack_from(self.shm.buf, self.slot_offset(seq))[0] == seq
+
+    def close(self):
+        """Unmap the segment; every pixels view from read() must be released first"""
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # A view is still alive; the mapping goes when it does
+
+class FakeShot:
+    def __init__(self, bgra):
+        self.height, self.width = bgra.shape[:2]
+        self.raw = bgra.tobytes()
+
+def main():
+    parser = argparse.ArgumentParser(description="Self-test of the shared-memory frame transport")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--fps", type=float, default=60.0)
+    parser.add_argument("--scale", type=float, default=0.5, help="Viewer scale factor")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    shots = [FakeShot(rng.integers(0, 255, (args.height, args.width, 4), dtype=np.uint8)) for _ in range(4)]
+    writer = ShmFrameWriter(args.width, args.height)
+    reader = ShmFrameReader(writer.name)
+    size = (int(args.width * args.scale), int(args.height * args.scale))
+    received, torn, latencies = [0], [0], []
+    done = threading.Event()
+
+    def _receive():
+        while not done.is_set():
+            frame = reader.read(timeout=0.2)
+            if frame is None:
+                continue
+            seq, info, pixels = frame
+            cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)  # The viewer's per-frame work
+            del frame, pixels
+            if not reader.still_valid(seq):
+                torn[0] += 1
+                continue
+            latencies.append(time.time() - info['timestamp'])
+            received[0] += 1
+
+    thread = threading.Thread(target=_receive, daemon=True)
+    thread.start()
+    write_times = []
+    for i in range(args.frames):
+        t = time.perf_counter()
+        writer.write(shots[i % len(shots)], (args.width, args.height), None, (0, 0), True, False, time.time())
+        write_times.append(time.perf_counter() - t)
+        time.sleep(1.0 / args.fps)
+    time.sleep(0.3)
+    done.set()
+    thread.join()
+    reader.close()
+    writer.close()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0
+    print(f"Wrote {args.frames} frames at {args.width}x{args.height} | "
+          f"write {sum(write_times) / len(write_times) * 1000:.2f} ms/frame | Received {received[0]} | "
+          f"Skipped {reader.frames_skipped} | Torn {torn[0]} | Latency p95 {p95:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# stats.py — PIPELINE INSTRUMENTATION
+# Per-stage timing histograms, counters and gauges with a local JSON stats endpoint
+#
+# Recording a sample is a perf_counter call, a log2 bucket lookup and a few
+# integer adds under a lock, so it is cheap enough to leave on in production.
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket i holds samples in [2^(i-1), 2^i) microseconds; the last bucket is open-ended
+BUCKET_COUNT = 28
+
+class Histogram:
+    """Log2-bucketed latency histogram in microseconds"""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        if us < 0:
+            us = 0
+        self.buckets[min(us.bit_length(), BUCKET_COUNT - 1)] += 1
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th sample, in microseconds"""
+        if not self.count:
+            return 0
+        target = self.count * pct / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min(1 << i, self.max_us)
+        return self.max_us
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_us / self.count / 1000.0, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(50) / 1000.0,
+            'p95_ms': self.percentile(95) / 1000.0,
+            'p99_ms': self.percentile(99) / 1000.0,
+            'max_ms': self.max_us / 1000.0,
+        }
+
+class PipelineStats:
+    """Thread-safe collection of stage timings, counters and gauges"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def record(self, stage, seconds):
+        """Record one timing sample for a stage"""
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.record(seconds)
+
+    def lap(self, stage, since):
+        """Record perf_counter() - since for a stage and return the new perf_counter()"""
+        now = time.perf_counter()
+        self.record(stage, now - since)
+        return now
+
+    def add(self, counter, amount=1):
+        """Increment a counter"""
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def set_gauge(self, gauge, value):
+        """Set a point-in-time value such as a queue depth"""
+        self.gauges[gauge] = value
+
+    def snapshot(self):
+        """JSON-serializable view of everything recorded so far"""
+        with self.lock:
+            uptime = time.time() - self.started
+            return {
+                'name': self.name,
+                'time': time.time(),
+                'uptime_s': round(uptime, 1),
+                'stages': {stage: hist.summary() for stage, hist in self.stages.items()},
+                'counters': dict(self.counters),
+                'rates': {counter: round(value / uptime, 1) if uptime > 0 else 0.0
+                          for counter, value in self.counters.items()},
+                'gauges': dict(self.gauges),
+            }
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve snapshot() as JSON on http://host:port/stats in a daemon thread"""
+        stats = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/stats'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(stats.snapshot(), indent=2).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer((host, port), StatsHandler)
+        except OSError as e:
+            print(f"[Stats] Could not start endpoint on {host}:{port}: {e}")
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"📊 Stats endpoint on http://{host}:{port}/stats")
+        return server
+
+    def start_json_log(self, path, interval=10.0):
+        """Append a snapshot as one JSON line every interval seconds"""
+        def _log():
+            while True:
+                time.sleep(interval)
+                try:
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(self.snapshot()) + '\n')
+                except Exception as e:
+                    print(f"[Stats] JSON log error: {e}")
+
+        threading.Thread(target=_log, daemon=True).start()
@@ -0,0 +1,223 @@
+# udp_transport.py — LOW-LATENCY UDP FRAME TRANSPORT
+# Frames are split into MTU-sized datagrams with sequence numbers and optional XOR parity.
+# Incomplete frames are dropped rather than retransmitted; the receiver asks for a fresh
+# keyframe over the reliable TCP channel instead. Input always stays on TCP.
+#
+# Datagram: [seq:u32][total_len:u32][index:u16][count:u16][fec_k:u8][flags:u8][payload]
+#   data fragment   : index = fragment number, count = number of data fragments
+#   parity fragment : index = group number, XOR of the fec_k data fragments in that group
+#
+# Loopback self-test with simulated loss:
+#   python udp_transport.py --loss 0.05 --fec 8
+
+import argparse
+import random
+import socket
+import struct
+import threading
+import time
+
+FRAG_HEADER = struct.Struct(">IIHHBB")
+MAX_PAYLOAD = 1200  # Fits the IPv6 minimum MTU with headers to spare, so nothing fragments at IP level
+FLAG_PARITY = 0x01
+FRAME_TIMEOUT = 0.25  # Seconds an incomplete frame may wait for stragglers
+SOCKET_BUFFER = 4 * 1024 * 1024
+
+def xor_bytes(blocks, size):
+    """XOR blocks together, zero-padding each to size"""
+    acc = 0
+    for block in blocks:
+        acc ^= int.from_bytes(bytes(block).ljust(size, b'\x00'), 'big')
+    return acc.to_bytes(size, 'big')
+
+class UdpFrameSender:
+    """Fragments frames into datagrams with optional XOR-parity FEC"""
+
+    def __init__(self, sock, addr, fec_group=0, loss=0.0):
+        self.sock = sock
+        self.addr = addr
+        self.fec_group = fec_group
+        self.loss = loss  # Simulated send-side loss for testing
+        self.seq = 0
+        self.datagrams_sent = 0
+
+    def sendto(self, datagram):
+        if self.loss and random.random() < self.loss:
+            return
+        self.sock.sendto(datagram, self.addr)
+        self.datagrams_sent += 1
+
+    def send_frame(self, data):
+        """Send one frame; returns its sequence number"""
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        view = memoryview(data)
+        total = len(view)
+        count = max(1, (total + MAX_PAYLOAD - 1) // MAX_PAYLOAD)
+        k = self.fec_group
+
+        group = []
+        for index in range(count):
+            chunk = view[index * MAX_PAYLOAD:(index + 1) * MAX_PAYLOAD]
+            self.sendto(FRAG_HEADER.pack(self.seq, total, index, count, k, 0) + chunk)
+            if k:
+                group.append(chunk)
+                if len(group) == k or index == count - 1:
+                    parity = xor_bytes(group, MAX_PAYLOAD)
+                    self.sendto(FRAG_HEADER.pack(self.seq, total, index // k, count, k, FLAG_PARITY) + parity)
+                    group = []
+        return self.seq
+
+class PartialFrame:
+    def __init__(self, total, count, fec_k):
+        self.total = total
+        self.count = count
+        self.fec_k = fec_k
+        self.fragments = {}
+        self.parity = {}
+        self.started = time.time()
+
+    def fragment_size(self, index):
+        if index == self.count - 1:
+            return self.total - index * MAX_PAYLOAD
+        return MAX_PAYLOAD
+
+    def try_recover(self, group):
+        """Rebuild the single missing data fragment of a group from its parity"""
+        start = group * self.fec_k
+        members = range(start, min(start + self.fec_k, self.count))
+        missing = [i for i in members if i not in self.fragments]
+        if len(missing) != 1 or group not in self.parity:
+            return False
+        present = [self.fragments[i] for i in members if i in self.fragments]
+        rebuilt = xor_bytes(present + [self.parity[group]], MAX_PAYLOAD)
+        self.fragments[missing[0]] = rebuilt[:self.fragment_size(missing[0])]
+        return True
+
+    def complete(self):
+        return len(self.fragments) == self.count
+
+    def assemble(self):
+        return b"".join(self.fragments[i] for i in range(self.count))
+
+class UdpFrameReceiver:
+    """Reassembles frames from one source host, drops incomplete ones and reports losses"""
+
+    def __init__(self, sock, source, on_loss=None, stats=None, loss=0.0):
+        self.sock = sock
+        self.source = source  # Only the host's IP may feed frames into pickle.loads
+        self.on_loss = on_loss
+        self.stats = stats
+        self.loss = loss  # Simulated receive-side loss for testing
+        self.partial = {}
+        self.last_delivered = 0
+
+    def count(self, counter, amount=1):
+        if self.stats:
+            self.stats.add(counter, amount)
+
+    def drop(self, seq):
+        self.partial.pop(seq, None)
+        self.count('frames_incomplete')
+        if self.on_loss:
+            self.on_loss(seq)
+
+    def read(self):
+        """Block until the next complete frame and return its bytes"""
+        while True:
+            datagram, addr = self.sock.recvfrom(65536)
+            if addr[0] != self.source:
+                self.count('datagrams_rejected')
+                continue
+            if self.loss and random.random() < self.loss:
+                continue
+            if len(datagram) < FRAG_HEADER.size:
+                continue
+            self.count('bytes_received', len(datagram))
+
+            seq, total, index, count, fec_k, flags = FRAG_HEADER.unpack_from(datagram)
+            if seq <= self.last_delivered and self.last_delivered - seq < 0x80000000:
+                continue  # Late fragment of a frame already delivered or dropped
+
+            frame = self.partial.get(seq)
+            if frame is None:
+                frame = self.partial[seq] = PartialFrame(total, count, fec_k)
+
+            payload = datagram[FRAG_HEADER.size:]
+            if flags & FLAG_PARITY:
+                frame.parity[index] = payload
+                if frame.try_recover(index):
+                    self.count('fragments_recovered')
+            else:
+                frame.fragments[index] = payload
+                if fec_k and frame.try_recover(index // fec_k):
+                    self.count('fragments_recovered')
+
+            # Expire frames that have waited too long for stragglers
+            now = time.time()
+            for old_seq in [s for s, f in self.partial.items() if now - f.started > FRAME_TIMEOUT]:
+                self.drop(old_seq)
+
+            if frame.complete() and seq in self.partial:
+                # Anything older than a completed frame is stale; drop it now
+                for old_seq in [s for s in self.partial if s < seq]:
+                    self.drop(old_seq)
+                del self.partial[seq]
+                self.last_delivered = seq
+                return frame.assemble()
+
+def open_udp_socket(bind_host='0.0.0.0', port=0):
+    """UDP socket with large buffers for bursty frame traffic"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, opt, SOCKET_BUFFER)
+        except OSError:
+            pass
+    sock.bind((bind_host, port))
+    return sock
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback self-test of the UDP frame transport")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--size", type=int, default=150000, help="Frame size in bytes")
+    parser.add_argument("--loss", type=float, default=0.02, help="Simulated datagram loss rate")
+    parser.add_argument("--fec", type=int, default=8, help="Data fragments per parity fragment, 0 = off")
+    parser.add_argument("--fps", type=float, default=30.0)
+    args = parser.parse_args()
+
+    rx = open_udp_socket('127.0.0.1')
+    tx = open_udp_socket('127.0.0.1')
+    rx.settimeout(1.0)
+    sender = UdpFrameSender(tx, rx.getsockname(), fec_group=args.fec, loss=args.loss)
+
+    from stats import PipelineStats
+    stats = PipelineStats("udp-selftest")
+    losses = []
+    receiver = UdpFrameReceiver(rx, '127.0.0.1', on_loss=losses.append, stats=stats)
+
+    delivered = []
+    def _receive():
+        try:
+            while True:
+                data = receiver.read()
+                delivered.append(data)
+        except socket.timeout:
+            pass
+
+    thread = threading.Thread(target=_receive, daemon=True)
+    thread.start()
+
+    frames = {}
+    for i in range(args.frames):
+        data = random.randbytes(args.size)
+        frames[sender.send_frame(data)] = data
+        time.sleep(1.0 / args.fps)
+    thread.join()
+
+    corrupt = sum(1 for d in delivered if d not in frames.values())
+    counters = stats.snapshot()['counters']
+    print(f"Sent {args.frames} frames | Delivered {len(delivered)} | Dropped {len(losses)} | "
+          f"Recovered fragments {counters.get('fragments_recovered', 0)} | Corrupt {corrupt}")
+
+if __name__ == "__main__":
+    main()